@@ -1,11 +1,33 @@
-import requests
+from datetime import timedelta
 import json
 from lib.cache_return_to_file import file_cache
-from models.normalized_data import NormalizedData
+from lib.http_session import DEFAULT_POOL_SIZE, DEFAULT_RETRIES, build_session, send
+from models.normalized_data import InstagramRecord
 
 
-@file_cache()
-def scrape_user(username: str):
+# The fields normalize_instagram_data reads, the rest of the profile is not cached
+PROFILE_FIELDS = (
+    "id",
+    "full_name",
+    "username",
+    "location",
+    "biography",
+    "profile_pic_url",
+    "business_email",
+    "edge_followed_by.count",
+    "edge_follow.count",
+    "edge_owner_to_timeline_media.count",
+)
+
+
+@file_cache(
+    ttl=timedelta(days=3),
+    soft_ttl=timedelta(hours=12),
+    key_args=("username",),
+    casefold_args=("username",),
+    fields=PROFILE_FIELDS,
+)
+def scrape_user(session, username: str):
     """Scrape Instagram user's data"""
     headers = {
         "x-ig-app-id": "936619743392459",
@@ -15,22 +37,37 @@ def scrape_user(username: str):
         "Accept-Encoding": "gzip, deflate, br",
         "Accept": "*/*",
     }
-    result = requests.get(
+    result = send(
+        session,
+        "instagram",
+        "GET",
         f"https://i.instagram.com/api/v1/users/web_profile_info/?username={username}",
         headers=headers,
         timeout=10,
     )
+    if result.status_code == 404:
+        print(f"User '{username}' not found.")
+        return None
+    result.raise_for_status()
     data = result.json()
     return data["data"]["user"]
 
 
 class InstagramAPI:
 
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES):
+        self.session = build_session(
+            pool_size=pool_size, retries=retries, platform="instagram"
+        )
+
     def get_user(self, username: str):
-        return scrape_user(username)
+        return scrape_user(self.session, username)
 
-    def normalize_instagram_data(self, data: dict) -> NormalizedData:
+    def normalize_instagram_data(self, data: dict) -> InstagramRecord:
         """Normalize Instagram user data"""
+        if not data:
+            return None
+
         name = data.get("full_name")
         username = data.get("username")
         location = data.get("location")  # May be None if not present
@@ -42,7 +79,7 @@ class InstagramAPI:
         followers_count = data.get("edge_followed_by", {}).get("count")
         following_count = data.get("edge_follow", {}).get("count")
         post_count = data.get("edge_owner_to_timeline_media", {}).get("count")
-        normalized_data = NormalizedData(
+        normalized_data = InstagramRecord(
             name=name,
             username=username,
             location=location,
@@ -55,7 +92,7 @@ class InstagramAPI:
         )
         return normalized_data
 
-    def get_normalized_user_data(self, username: str) -> NormalizedData:
+    def get_normalized_user_data(self, username: str) -> InstagramRecord:
         data = self.get_user(username)
         normalized_data = self.normalize_instagram_data(data)
         return normalized_data
@@ -1,72 +1,212 @@
+import json
 import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
 import requests
 from dotenv import load_dotenv
-from lib.cache_return_to_file import file_cache
+from lib.cache_return_to_file import file_cache, uncached
+from lib.http_session import DEFAULT_POOL_SIZE, DEFAULT_RETRIES, build_session, send
+from models.normalized_data import RedditRecord
 
 
-@file_cache()
-def fetch_user_details(access_token, base_url, user_agent, username):
-    url = f"{base_url}/user/{username}/about"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "User-Agent": user_agent,
-    }
+DEFAULT_TOKEN_PATH = "./.tokens/reddit.json"
+# Refresh tokens this many seconds before Reddit says they expire
+TOKEN_EXPIRY_MARGIN = 60
+
+
+# The fields normalize_reddit_data reads, the rest of the response is not cached
+USER_DETAIL_FIELDS = ("name", "id", "created_utc", "is_employee", "is_mod")
+
+
+@file_cache(
+    ttl=timedelta(days=2),
+    soft_ttl=timedelta(hours=6),
+    key_args=("username",),
+    casefold_args=("username",),
+    fields=USER_DETAIL_FIELDS,
+)
+def fetch_user_details(api, username):
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        response = api.get(f"/user/{username}/about")
+        if response.status_code == 404:
+            print(f"User '{username}' not found.")
+            return None
         response.raise_for_status()
         return response.json()["data"]
     except requests.exceptions.RequestException as e:
         print(f"Error fetching user details: {e}")
-        return None
+        return uncached(None)
 
 
 class RedditAPI:
     BASE_URL = "https://oauth.reddit.com"
-
-    def __init__(self, client_id, client_secret, user_agent):
+    TOKEN_URL = "https://www.reddit.com/api/v1/access_token"
+
+    def __init__(
+        self,
+        client_id,
+        client_secret,
+        user_agent,
+        pool_size=DEFAULT_POOL_SIZE,
+        retries=DEFAULT_RETRIES,
+        token_path=None,
+    ):
         self.client_id = client_id
         self.client_secret = client_secret
         self.user_agent = user_agent
-        self.access_token = self.get_access_token()
+        self.session = build_session(
+            pool_size=pool_size, retries=retries, platform="reddit"
+        )
+        self.token_path = token_path or os.getenv(
+            "REDDIT_TOKEN_PATH", DEFAULT_TOKEN_PATH
+        )
+        self._token = None
+        self._token_expires_at = 0
+        self._token_lock = threading.Lock()
+        # Pacing state from the X-Ratelimit-* headers of the last response
+        self._pace_lock = threading.Lock()
+        self._next_request_at = 0
+        self._request_interval = 0
+        self.load_token()
+
+    @property
+    def access_token(self):
+        """A token valid for at least TOKEN_EXPIRY_MARGIN seconds, refreshed if needed"""
+        with self._token_lock:
+            if time.time() >= self._token_expires_at - TOKEN_EXPIRY_MARGIN:
+                self._get_access_token()
+            return self._token
 
     def get_access_token(self):
+        with self._token_lock:
+            return self._get_access_token()
+
+    def _get_access_token(self):
         auth = requests.auth.HTTPBasicAuth(self.client_id, self.client_secret)
         data = {"grant_type": "client_credentials"}
         headers = {"User-Agent": self.user_agent}
         try:
-            response = requests.post(
-                "https://www.reddit.com/api/v1/access_token",
+            response = send(
+                self.session,
+                "reddit",
+                "POST",
+                self.TOKEN_URL,
                 auth=auth,
                 data=data,
                 headers=headers,
                 timeout=10,
             )
             response.raise_for_status()
-            return response.json()["access_token"]
+            token = response.json()
         except requests.exceptions.RequestException as e:
             print(f"Error obtaining access token: {e}")
             return None
 
-    def fetch_user_details(self, username):
-        if not self.access_token:
-            print("Access token is missing. Unable to fetch user details.")
-            return None
+        self._token = token["access_token"]
+        self._token_expires_at = time.time() + token.get("expires_in", 3600)
+        self.save_token()
+        return self._token
 
-        return fetch_user_details(
-            self.access_token, self.BASE_URL, self.user_agent, username
-        )
+    def load_token(self):
+        """Reuse a token saved by an earlier process for the same client id"""
+        try:
+            with open(self.token_path, encoding="utf-8") as f:
+                token = json.load(f).get(self.client_id)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        if token:
+            self._token = token["access_token"]
+            self._token_expires_at = token["expires_at"]
+
+    def save_token(self):
+        try:
+            with open(self.token_path, encoding="utf-8") as f:
+                tokens = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            tokens = {}
+        tokens[self.client_id] = {
+            "access_token": self._token,
+            "expires_at": self._token_expires_at,
+        }
+
+        # The file holds credentials, so it is only readable by its owner
+        directory = os.path.dirname(self.token_path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(tokens, f)
+            os.replace(tmp_path, self.token_path)
+        except OSError as e:
+            print(f"Error saving access token: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _pace(self):
+        """Space requests out so the rate limit window is never exhausted"""
+        with self._pace_lock:
+            now = time.monotonic()
+            start = max(now, self._next_request_at)
+            self._next_request_at = start + self._request_interval
+        if start > now:
+            time.sleep(start - now)
+
+    def _update_rate_limit(self, headers):
+        remaining = headers.get("X-Ratelimit-Remaining")
+        reset = headers.get("X-Ratelimit-Reset")
+        if remaining is None or reset is None:
+            return
+        remaining, reset = float(remaining), float(reset)
+        with self._pace_lock:
+            if remaining < 1:
+                self._next_request_at = time.monotonic() + reset
+                self._request_interval = 0
+            else:
+                self._request_interval = reset / remaining
+
+    def get(self, path):
+        """
+        GET an OAuth API path, paced by Reddit's rate limit headers. An expired
+        or revoked token is refreshed and the request retried once.
+        """
+        for attempt in range(2):
+            token = self.access_token if attempt == 0 else self.get_access_token()
+            if not token:
+                raise requests.exceptions.RequestException("Access token is missing")
+
+            self._pace()
+            response = send(
+                self.session,
+                "reddit",
+                "GET",
+                f"{self.BASE_URL}{path}",
+                headers={
+                    "Authorization": f"Bearer {token}",
+                    "User-Agent": self.user_agent,
+                },
+                timeout=10,
+            )
+            self._update_rate_limit(response.headers)
+            if response.status_code != 401:
+                break
+        return response
+
+    def fetch_user_details(self, username):
+        return fetch_user_details(self, username)
 
     def normalize_reddit_data(self, user_data):
         if not user_data:
             return None
 
-        return {
-            "username": user_data.get("name"),
-            "user_id": user_data.get("id"),
-            "account_created": user_data.get("created_utc"),
-            "is_employee": user_data.get("is_employee"),
-            "is_moderator": user_data.get("is_mod"),
-        }
+        return RedditRecord(
+            username=user_data.get("name"),
+            user_id=user_data.get("id"),
+            account_created=user_data.get("created_utc"),
+            is_employee=user_data.get("is_employee"),
+            is_moderator=user_data.get("is_mod"),
+        )
 
     def get_normalized_user_data(self, username):
         user_data = self.fetch_user_details(username)
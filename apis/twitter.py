@@ -1,52 +1,109 @@
 import os
 import json
+import re
+import time
+from datetime import timedelta
 import tweepy
 from dotenv import load_dotenv
-from lib.cache_return_to_file import file_cache
-from models.normalized_data import NormalizedData
+from lib.cache_return_to_file import file_cache, uncached
+from lib.http_session import (
+    DEFAULT_BACKOFF_FACTOR,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_RETRIES,
+    THROTTLE_RETRIES,
+    build_session,
+)
+from lib.metrics import metrics
+from lib.rate_limit import get_limiter
+from models.normalized_data import TwitterRecord
 
 
-@file_cache()
-def fetch_user_info(token, username):
+USER_FIELDS = ["id", "name", "username", "location", "description", "public_metrics"]
+# Most usernames the users lookup endpoint accepts in one request
+MAX_USERNAMES_PER_REQUEST = 100
+# One invalid username fails a whole users lookup request
+VALID_USERNAME = re.compile(r"^[A-Za-z0-9_]{1,15}$")
+
+
+def call_with_limits(method, **kwargs):
+    """
+    Call a tweepy.Client method through the shared Twitter rate limiter. A 429
+    holds every Twitter request until the x-rate-limit-reset time, then retries.
+    """
+    limiter = get_limiter("twitter")
+    for attempt in range(THROTTLE_RETRIES + 1):
+        try:
+            with limiter.slot(), metrics.time(
+                "stage_seconds", platform="twitter", stage="http"
+            ):
+                return method(**kwargs)
+        except tweepy.TooManyRequests as e:
+            if attempt == THROTTLE_RETRIES:
+                raise
+            reset = e.response.headers.get("x-rate-limit-reset")
+            if reset:
+                delay = max(int(reset) - time.time(), 1)
+            else:
+                delay = DEFAULT_BACKOFF_FACTOR * 2 ** (attempt + 1)
+            print(f"twitter throttled with 429, waiting {delay:.1f}s")
+            limiter.backoff(delay)
+
+
+def user_to_dict(user):
+    return {
+        "id": user.id,
+        "name": user.name,
+        "username": user.username,
+        "location": user.location,
+        "description": user.description,
+        "followers_count": user.public_metrics["followers_count"],
+        "following_count": user.public_metrics["following_count"],
+        "tweet_count": user.public_metrics["tweet_count"],
+    }
+
+
+@file_cache(
+    ttl=timedelta(days=2),
+    soft_ttl=timedelta(hours=6),
+    key_args=("username",),
+    casefold_args=("username",),
+)
+def fetch_user_info(client, username):
     """Fetch detailed user information from Twitter."""
-    client = tweepy.Client(bearer_token=token)
     try:
-        user = client.get_user(
-            username=username,
-            user_fields=[
-                "id",
-                "name",
-                "username",
-                "location",
-                "description",
-                "public_metrics",
-            ],
+        user = call_with_limits(
+            client.get_user, username=username, user_fields=USER_FIELDS
         )
         if user.data:
-            return {
-                "id": user.data.id,
-                "name": user.data.name,
-                "username": user.data.username,
-                "location": user.data.location,
-                "description": user.data.description,
-                "followers_count": user.data.public_metrics["followers_count"],
-                "following_count": user.data.public_metrics["following_count"],
-                "tweet_count": user.data.public_metrics["tweet_count"],
-            }
+            return user_to_dict(user.data)
         else:
             print(f"User '{username}' not found.")
             return None
     except tweepy.TweepyException as e:
         print(f"Error fetching user info: {e}")
-        return None
+        return uncached(None)
 
 
-@file_cache()
-def fetch_recent_tweets(token, user_id, max_results=5):
+def fetch_users_info(client, usernames):
+    """
+    Fetch up to MAX_USERNAMES_PER_REQUEST users with a single request.
+    Returns:
+        dict: Casefolded username to user information, missing users are left out.
+    """
+    response = call_with_limits(
+        client.get_users, usernames=usernames, user_fields=USER_FIELDS
+    )
+    return {
+        user.username.casefold(): user_to_dict(user) for user in response.data or []
+    }
+
+
+@file_cache(ttl=timedelta(hours=1), key_args=("user_id", "max_results"))
+def fetch_recent_tweets(client, user_id, max_results=5):
     """Fetch recent tweets of a user by user ID."""
-    client = tweepy.Client(bearer_token=token)
     try:
-        tweets = client.get_users_tweets(
+        tweets = call_with_limits(
+            client.get_users_tweets,
             id=user_id,
             max_results=max_results,
             tweet_fields=["id", "text", "created_at"],
@@ -61,19 +118,61 @@ def fetch_recent_tweets(token, user_id, max_results=5):
             return []
     except tweepy.TweepyException as e:
         print(f"Error fetching tweets: {e}")
-        return []
+        return uncached([])
 
 
 class TwitterAPI:
-    def __init__(self, token):
+    def __init__(self, token, pool_size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES):
         self.token = token
+        self.client = tweepy.Client(bearer_token=token)
+        build_session(
+            pool_size=pool_size,
+            retries=retries,
+            session=self.client.session,
+            platform="twitter",
+        )
 
     def get_user_info(self, username):
         """Fetch detailed user information from Twitter."""
-        return fetch_user_info(self.token, username)
+        return fetch_user_info(self.client, username)
+
+    def get_users_info(self, usernames):
+        """
+        Fetch many users, batching cache misses into bulk lookups of up to
+        MAX_USERNAMES_PER_REQUEST usernames. Each user's result is cached as if
+        fetched with get_user_info.
+        Args:
+            usernames (list): Twitter usernames.
+        Returns:
+            dict: Username to user information, or None if not found or failed.
+        """
+        results = {}
+        missing = []
+        for username in dict.fromkeys(usernames):
+            found, user_info = fetch_user_info.lookup(self.client, username)
+            if found:
+                results[username] = user_info
+            elif VALID_USERNAME.match(username):
+                missing.append(username)
+            else:
+                results[username] = fetch_user_info.store(None, self.client, username)
+
+        for i in range(0, len(missing), MAX_USERNAMES_PER_REQUEST):
+            chunk = missing[i : i + MAX_USERNAMES_PER_REQUEST]
+            try:
+                users = fetch_users_info(self.client, chunk)
+            except tweepy.TweepyException as e:
+                print(f"Error fetching users info: {e}")
+                results.update(dict.fromkeys(chunk))
+                continue
+            for username in chunk:
+                results[username] = fetch_user_info.store(
+                    users.get(username.casefold()), self.client, username
+                )
+        return results
 
     def get_recent_tweets(self, user_id, max_results=5):
-        return fetch_recent_tweets(self.token, user_id, max_results)
+        return fetch_recent_tweets(self.client, user_id, max_results)
 
     def normalize_twitter_data(self, user_info):
         """
@@ -81,21 +180,21 @@ class TwitterAPI:
         Args:
             user_info (dict): Raw user information fetched from Twitter.
         Returns:
-            dict: Normalized user data.
+            TwitterRecord: Normalized user data.
         """
         if not user_info:
             return None
 
-        return {
-            "id": user_info.get("id"),
-            "name": user_info.get("name"),
-            "username": user_info.get("username"),
-            "location": user_info.get("location"),
-            "bio": user_info.get("description"),
-            "profile_picture": None,  # Placeholder as profile picture URL is not fetched here
-            "email": None,  # Email is not exposed by the Twitter API
-            "connections": user_info.get("followers_count"),
-        }
+        return TwitterRecord(
+            id=user_info.get("id"),
+            name=user_info.get("name"),
+            username=user_info.get("username"),
+            location=user_info.get("location"),
+            bio=user_info.get("description"),
+            profile_picture=None,  # Placeholder as profile picture URL is not fetched here
+            email=None,  # Email is not exposed by the Twitter API
+            connections=user_info.get("followers_count"),
+        )
 
     def get_normalized_user_data(self, username):
         """
@@ -103,7 +202,7 @@ class TwitterAPI:
         Args:
             username (str): The Twitter username.
         Returns:
-            dict: Normalized user data, or None if the user is not found.
+            TwitterRecord: Normalized user data, or None if the user is not found.
         """
         user_info = self.get_user_info(username)
 
@@ -114,6 +213,19 @@ class TwitterAPI:
             print(f"Failed to fetch or normalize data for username: {username}")
             return None
 
+    def get_normalized_users_data(self, usernames):
+        """
+        Fetch many users with bulk lookups and return them in a normalized format.
+        Args:
+            usernames (list): Twitter usernames.
+        Returns:
+            dict: Username to normalized user data, or None if not found.
+        """
+        return {
+            username: self.normalize_twitter_data(user_info)
+            for username, user_info in self.get_users_info(usernames).items()
+        }
+
     def fetch_twitter_name(self, username):
         """
         Fetch the full name of a user from Twitter using their username.
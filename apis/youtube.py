@@ -1,62 +1,246 @@
+import hashlib
+import json
 import os
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
 import requests
-import hashlib
-import pickle
 from dotenv import load_dotenv
-from lib.cache_return_to_file import file_cache
+from lib.cache_backends import file_lock
+from lib.cache_return_to_file import file_cache, uncached
+from lib.http_session import DEFAULT_POOL_SIZE, DEFAULT_RETRIES, build_session, send
+from models.normalized_data import YouTubeRecord
+
+
+CHANNEL_PARTS = "id,snippet,contentDetails,statistics,status"
+# The fields normalize_youtube_data reads, the rest of a channel is not cached
+CHANNEL_FIELDS = (
+    "id",
+    "snippet.title",
+    "snippet.description",
+    "snippet.country",
+    "statistics.subscriberCount",
+    "statistics.viewCount",
+    "statistics.videoCount",
+    "status.privacyStatus",
+    "status.isLinked",
+    "contentDetails",
+)
+# Quota units charged per request, see https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS = {"search": 100, "channels": 1}
+DEFAULT_DAILY_QUOTA = 10_000
+DEFAULT_QUOTA_PATH = "./.tokens/youtube_quota.json"
+# Most ids the channels endpoint accepts in one request
+MAX_CHANNELS_PER_REQUEST = 50
+# The quota resets at midnight Pacific time, approximated without DST
+QUOTA_TIMEZONE = timezone(timedelta(hours=-8))
+
+
+class QuotaExceededError(Exception):
+    pass
+
 
+def search_channel_by_username(api, user):
+    """Find a channel id with the search endpoint, which costs 100 quota units"""
+    params = {"part": "snippet", "q": user, "type": "channel", "maxResults": 1}
+    items = api.request("search", params).get("items", [])
+    return items[0]["snippet"]["channelId"] if items else None
 
-def search_channel_by_username(user, params, url):
+
+@file_cache(ttl=timedelta(days=30), key_args=("user",), casefold_args=("user",))
+def resolve_channel_id(api, user):
+    """
+    Resolve a username to a channel id. The 1 unit handle and legacy username
+    lookups on the channels endpoint are tried before search. They return the
+    channel details too, which are cached for fetch_channel_details.
+    """
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        items = response.json().get("items", [])
-        if items:
-            return items[0]["snippet"]["channelId"]
-        else:
+        for lookup in ("forHandle", "forUsername"):
+            params = {"part": CHANNEL_PARTS, lookup: user}
+            try:
+                items = api.request("channels", params).get("items", [])
+            except requests.exceptions.HTTPError as e:
+                # Names that are not valid handles are rejected, search can still match them
+                if e.response is not None and e.response.status_code == 400:
+                    continue
+                raise
+            if items:
+                fetch_channel_details.store(items[0], api, items[0]["id"])
+                return items[0]["id"]
+
+        channel_id = search_channel_by_username(api, user)
+        if not channel_id:
             print(f"No channel found for username: {user}")
-            return None
-    except requests.exceptions.RequestException as e:
+        return channel_id
+    except (requests.exceptions.RequestException, QuotaExceededError) as e:
         print(f"Error searching for channel: {e}")
-        return None
+        return uncached(None)
 
 
-@file_cache()
-def fetch_channel_details(params, url):
+@file_cache(
+    ttl=timedelta(days=7),
+    soft_ttl=timedelta(days=1),
+    key_args=("channel_id",),
+    fields=CHANNEL_FIELDS,
+)
+def fetch_channel_details(api, channel_id):
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json().get("items", [])
+        params = {"part": CHANNEL_PARTS, "id": channel_id}
+        data = api.request("channels", params).get("items", [])
         return data[0] if data else None
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, QuotaExceededError) as e:
         print(f"Error fetching channel details: {e}")
-        return None
+        return uncached(None)
 
 
 class YouTubeAPI:
-    def __init__(self, api_key):
+    def __init__(
+        self,
+        api_key,
+        pool_size=DEFAULT_POOL_SIZE,
+        retries=DEFAULT_RETRIES,
+        daily_quota=DEFAULT_DAILY_QUOTA,
+        quota_path=None,
+    ):
         self.api_key = api_key
         self.base_url = "https://www.googleapis.com/youtube/v3"
+        self.session = build_session(
+            pool_size=pool_size, retries=retries, platform="youtube"
+        )
+        self.daily_quota = daily_quota
+        self.quota_path = quota_path or os.getenv(
+            "YOUTUBE_QUOTA_PATH", DEFAULT_QUOTA_PATH
+        )
+        # The spend is saved per key, under a hash so the file holds no credentials
+        self._quota_key = hashlib.sha256(str(api_key).encode()).hexdigest()[:16]
+        self._quota_lock = threading.Lock()
+
+    @property
+    def quota_used(self):
+        """Units spent today, by this and every other process using the key"""
+        with self._quota_lock:
+            return self.load_quota().get(self._quota_key, 0)
+
+    @property
+    def quota_remaining(self):
+        return self.daily_quota - self.quota_used
+
+    @property
+    def quota_exhausted(self):
+        """Whether not even the cheapest request fits in today's quota"""
+        return self.quota_remaining < min(QUOTA_COSTS.values())
+
+    def load_quota(self):
+        """Key hash to the units spent today, read from the saved quota file"""
+        today = datetime.now(QUOTA_TIMEZONE).date().isoformat()
+        try:
+            with open(self.quota_path, encoding="utf-8") as f:
+                spend = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        # Spend from before midnight Pacific time no longer counts
+        return spend.get("used", {}) if spend.get("day") == today else {}
+
+    def save_quota(self, used):
+        directory = os.path.dirname(self.quota_path) or "."
+        os.makedirs(directory, exist_ok=True)
+        today = datetime.now(QUOTA_TIMEZONE).date().isoformat()
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"day": today, "used": used}, f)
+            os.replace(tmp_path, self.quota_path)
+        except OSError as e:
+            print(f"Error saving YouTube quota: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
 
-    def search_channel_by_username(self, user):
-        url = f"{self.base_url}/search"
-        params = {
-            "part": "snippet",
-            "q": user,
-            "type": "channel",
-            "key": self.api_key,
-            "maxResults": 1,
-        }
-        return search_channel_by_username(user, params, url)
+    def spend_quota(self, endpoint):
+        """
+        Charge the cost of one request to today's saved spend, or raise if it
+        would pass the daily quota. The file is locked while it is updated, so
+        concurrent processes share the quota.
+        """
+        cost = QUOTA_COSTS[endpoint]
+        with self._quota_lock, file_lock(os.path.abspath(self.quota_path) + ".lock"):
+            used = self.load_quota()
+            spent = used.get(self._quota_key, 0)
+            if spent + cost > self.daily_quota:
+                raise QuotaExceededError(
+                    f"YouTube quota exhausted: {spent}/{self.daily_quota} "
+                    f"units used, {endpoint} costs {cost}"
+                )
+            used[self._quota_key] = spent + cost
+            self.save_quota(used)
+
+    def request(self, endpoint, params):
+        self.spend_quota(endpoint)
+        response = send(
+            self.session,
+            "youtube",
+            "GET",
+            f"{self.base_url}/{endpoint}",
+            params={**params, "key": self.api_key},
+            timeout=10,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def resolve_channel_id(self, user):
+        return resolve_channel_id(self, user)
 
     def fetch_channel_details(self, channel_id):
-        url = f"{self.base_url}/channels"
-        params = {
-            "part": "id,snippet,contentDetails,statistics,status",
-            "id": channel_id,
-            "key": self.api_key,
-        }
-        return fetch_channel_details(params, url)
+        return fetch_channel_details(self, channel_id)
+
+    def fetch_channels_details(self, channel_ids):
+        """
+        Fetch many channels, batching cache misses into channels requests of up
+        to MAX_CHANNELS_PER_REQUEST ids. Each channel is cached as if fetched
+        with fetch_channel_details.
+        Returns:
+            dict: Channel id to channel data, or None if not found or failed.
+        """
+        results = {}
+        missing = []
+        for channel_id in dict.fromkeys(channel_ids):
+            found, channel = fetch_channel_details.lookup(self, channel_id)
+            if found:
+                results[channel_id] = channel
+            else:
+                missing.append(channel_id)
+
+        for i in range(0, len(missing), MAX_CHANNELS_PER_REQUEST):
+            chunk = missing[i : i + MAX_CHANNELS_PER_REQUEST]
+            params = {
+                "part": CHANNEL_PARTS,
+                "id": ",".join(chunk),
+                "maxResults": MAX_CHANNELS_PER_REQUEST,
+            }
+            try:
+                items = self.request("channels", params).get("items", [])
+            except (requests.exceptions.RequestException, QuotaExceededError) as e:
+                print(f"Error fetching channels details: {e}")
+                results.update(dict.fromkeys(chunk))
+                continue
+            channels = {item["id"]: item for item in items}
+            for channel_id in chunk:
+                results[channel_id] = fetch_channel_details.store(
+                    channels.get(channel_id), self, channel_id
+                )
+        return results
+
+    def prefetch_channels(self, usernames):
+        """
+        Warm the details of every username whose channel id is already cached
+        with batched channels requests. Unresolved usernames are left for
+        get_normalized_channel_data, whose handle lookup returns details anyway.
+        """
+        channel_ids = []
+        for username in usernames:
+            found, channel_id = resolve_channel_id.lookup(self, username)
+            if found and channel_id:
+                channel_ids.append(channel_id)
+        self.fetch_channels_details(channel_ids)
 
     def normalize_youtube_data(self, channel_data):
         if not channel_data:
@@ -66,23 +250,23 @@ class YouTubeAPI:
         statistics = channel_data.get("statistics", {})
         status = channel_data.get("status", {})
         content_details = channel_data.get("contentDetails", {})
-        return {
-            "id": channel_data.get("id"),
-            "title": snippet.get("title"),
-            "description": snippet.get("description"),
-            "statistics": {
+        return YouTubeRecord(
+            id=channel_data.get("id"),
+            title=snippet.get("title"),
+            description=snippet.get("description"),
+            statistics={
                 "subscriber_count": statistics.get("subscriberCount"),
                 "view_count": statistics.get("viewCount"),
                 "video_count": statistics.get("videoCount"),
             },
-            "contentDetails": content_details,
-            "location": snippet.get("country"),
-            "privacyStatus": status.get("privacyStatus"),
-            "isLinked": status.get("isLinked"),
-        }
+            contentDetails=content_details,
+            location=snippet.get("country"),
+            privacyStatus=status.get("privacyStatus"),
+            isLinked=status.get("isLinked"),
+        )
 
     def get_normalized_channel_data(self, username):
-        channel_id = self.search_channel_by_username(username)
+        channel_id = self.resolve_channel_id(username)
         if channel_id:
             channel_data = self.fetch_channel_details(channel_id)
             if channel_data:
@@ -0,0 +1,346 @@
+import contextlib
+import json
+import sys
+import time
+from itertools import islice
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+from lib.snapshots import diff_records, to_json_value
+from lib.fetch import QUOTA_EXHAUSTED, get_usernames, iter_platform_data
+from models.normalized_data import json_default
+from privacy_score import (
+    SCORE_VERSION,
+    calculate_overall_privacy_score,
+    provisional_score,
+)
+
+# Requests read and prefetched together, the most usernames one Twitter bulk
+# lookup takes
+CHUNK_SIZE = 100
+
+
+@contextlib.contextmanager
+def open_input(path):
+    if path == "-":
+        yield sys.stdin
+    else:
+        with open(path, encoding="utf-8") as f:
+            yield f
+
+
+@contextlib.contextmanager
+def open_output(path):
+    """
+    Open the JSONL output. When writing to stdout, progress prints are moved to
+    stderr so they don't interleave with the results.
+    """
+    if path == "-":
+        out = sys.stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            yield out
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            yield f
+
+
+class InvalidRequest(dict):
+    """The error record of an input line that is not a valid request"""
+
+
+def read_requests(lines):
+    """
+    Yield a request dict for each plain username or JSON object line, and an
+    InvalidRequest for each line that fails to parse
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("{"):
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                yield InvalidRequest(line=number, error=f"Invalid JSON: {e}")
+        else:
+            yield {"username": line}
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def prefetch(clients, requests, journal=None):
+    """
+    Warm the cache for a chunk of requests with bulk Twitter user lookups and
+    batched YouTube channel requests, so per-user lookups become cache hits.
+    Units the journal has finished are not prefetched again.
+    """
+    # Lines for the same username may override different platforms
+    usernames = [
+        (
+            request["username"],
+            get_usernames(request["username"], list(clients), **get_overrides(request)),
+        )
+        for request in requests
+        if request.get("username")
+    ]
+
+    def pending(platform):
+        return [
+            platform_usernames[platform]
+            for username, platform_usernames in usernames
+            if journal is None
+            or not journal.done(username, platform, platform_usernames[platform])
+        ]
+
+    if "twitter" in clients and (names := pending("twitter")):
+        try:
+            clients["twitter"].get_users_info(names)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"An error occurred while prefetching Twitter data: {e}")
+    if "youtube" in clients and (names := pending("youtube")):
+        try:
+            clients["youtube"].prefetch_channels(names)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"An error occurred while prefetching YouTube data: {e}")
+
+
+def get_overrides(request):
+    return {key: value for key, value in request.items() if key != "username"}
+
+
+def score_request(clients, request, platform_timeouts=None, total_timeout=None):
+    """
+    Fetch and score a request.
+    Returns:
+        dict: username, per-platform data, privacy_score, and stale, the
+        platforms whose data came from a cache entry being refreshed.
+    """
+    username = request.get("username")
+    if not username:
+        raise ValueError(f"Request has no username: {request}")
+    usernames = get_usernames(username, list(clients), **get_overrides(request))
+    all_data = dict.fromkeys(usernames)
+    stale = []
+    for platform, data, _, _, platform_stale in iter_platform_data(
+        clients, usernames, platform_timeouts, total_timeout
+    ):
+        all_data[platform] = data
+        if platform_stale:
+            stale.append(platform)
+    return {
+        "username": username,
+        "data": all_data,
+        "privacy_score": calculate_overall_privacy_score(all_data),
+        "stale": sorted(stale),
+    }
+
+
+def stream_request(clients, request, platform_timeouts=None, total_timeout=None):
+    """
+    Score a request as score_request does, yielding an event as each platform
+    finishes. Platform events carry the score over the platforms fetched so far
+    and the bounds the pending platforms can still move the final score within.
+    Yields:
+        dict: `platform` events, then a `final` event with score_request's fields.
+    """
+    username = request.get("username")
+    if not username:
+        raise ValueError(f"Request has no username: {request}")
+    usernames = get_usernames(username, list(clients), **get_overrides(request))
+
+    start = time.monotonic()
+    fetched = {}
+    stale_platforms = []
+    for platform, data, elapsed, _, stale in iter_platform_data(
+        clients, usernames, platform_timeouts, total_timeout
+    ):
+        fetched[platform] = data
+        if stale:
+            stale_platforms.append(platform)
+        pending = [platform for platform in usernames if platform not in fetched]
+        score, lowest, highest = provisional_score(fetched, pending)
+        yield {
+            "event": "platform",
+            "username": username,
+            "platform": platform,
+            "data": data,
+            "elapsed": round(elapsed, 3),
+            "stale": stale,
+            "provisional_score": score,
+            "score_bounds": [lowest, highest],
+            "pending": pending,
+        }
+
+    all_data = {platform: fetched[platform] for platform in usernames}
+    yield {
+        "event": "final",
+        "username": username,
+        "data": all_data,
+        "privacy_score": calculate_overall_privacy_score(all_data),
+        "stale": sorted(stale_platforms),
+        "elapsed": round(time.monotonic() - start, 3),
+    }
+
+
+def journaled_request(
+    clients, request, platform_timeouts=None, total_timeout=None, journal=None
+):
+    """
+    Score a request as score_request does, fetching only the platforms the
+    journal has not finished and logging each one fetched. A platform that
+    failed or timed out reads as "not found", and is fetched again on the next
+    run until it runs out of attempts. A platform skipped for its exhausted
+    quota costs no attempt, so a run on a later day fetches it.
+    """
+    username = request.get("username")
+    if not username:
+        raise ValueError(f"Request has no username: {request}")
+    usernames = get_usernames(username, list(clients), **get_overrides(request))
+    todo = {
+        platform: name
+        for platform, name in usernames.items()
+        if not journal.done(username, platform, name)
+    }
+
+    for platform, data, _, error, stale in iter_platform_data(
+        clients, todo, platform_timeouts, total_timeout
+    ):
+        if error != QUOTA_EXHAUSTED:
+            journal.record(username, platform, usernames[platform], data, error, stale)
+
+    all_data = {
+        platform: journal.result(username, platform, name)
+        for platform, name in usernames.items()
+    }
+    return {
+        "username": username,
+        "data": all_data,
+        "privacy_score": calculate_overall_privacy_score(all_data),
+        "stale": sorted(
+            platform
+            for platform, name in usernames.items()
+            if (username, platform, name) in journal.stale
+        ),
+    }
+
+
+def refresh_request(
+    clients, request, platform_timeouts=None, total_timeout=None, store=None
+):
+    """
+    Fetch a user again and compare the weighted fields with their snapshot.
+    The score is only recomputed and the snapshot only rewritten when something
+    changed. Platforms that failed or timed out, and platforms without a client,
+    keep their snapshot records, so an outage is not reported as a change.
+    A snapshot scored under an older SCORE_VERSION is rescored under the current
+    one first, so score_delta only reflects changed fields.
+    Returns:
+        list: Change feed entries, one per changed field, empty if nothing changed.
+    """
+    username = request.get("username")
+    if not username:
+        raise ValueError(f"Request has no username: {request}")
+    fetched = {}
+    for platform, data, _, error, _ in iter_platform_data(
+        clients,
+        get_usernames(username, list(clients), **get_overrides(request)),
+        platform_timeouts,
+        total_timeout,
+    ):
+        if error is None:
+            fetched[platform] = data
+    fetched = to_json_value(fetched)
+
+    snapshot = store.get(username)
+    old_data, old_score, score_version = snapshot or ({}, None, SCORE_VERSION)
+    if score_version != SCORE_VERSION:
+        old_score = calculate_overall_privacy_score(old_data)
+    all_data = {**old_data, **fetched}
+    changes = diff_records(old_data, all_data)
+    if (
+        snapshot is not None
+        and not changes
+        and set(old_data) == set(all_data)
+        and score_version == SCORE_VERSION
+    ):
+        return []
+
+    privacy_score = calculate_overall_privacy_score(all_data)
+    store.save(username, all_data, privacy_score)
+    score_delta = round(privacy_score - old_score, 2) if old_score is not None else None
+    return [
+        {
+            "username": username,
+            "platform": platform,
+            "field": field,
+            "old": old,
+            "new": new,
+            "score_delta": score_delta,
+        }
+        for platform, field, old, new in changes
+    ]
+
+
+def run_batch(
+    clients,
+    lines,
+    out,
+    workers=8,
+    platform_timeouts=None,
+    total_timeout=None,
+    handler=score_request,
+    prefetcher=prefetch,
+):
+    """
+    Run handler on every request read from lines with a bounded pool of workers.
+    Requests are read in chunks that are prefetched with bulk lookups first.
+    Results are written to out as they complete, so memory is bounded by the
+    chunk size and 2 * workers, however long the input is. A handler returns one
+    result, or a list of results written one per line. Lines that are not valid
+    requests are written as {"line", "error"} records.
+    Returns:
+        tuple: Number of requests handled and elapsed seconds.
+    """
+
+    def write_results(results):
+        if not isinstance(results, list):
+            results = [results]
+        for result in results:
+            out.write(json.dumps(result, default=json_default) + "\n")
+        out.flush()
+
+    def write(future):
+        try:
+            results = future.result()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            results = {"username": in_flight[future].get("username"), "error": str(e)}
+        write_results(results)
+
+    start = time.monotonic()
+    count = 0
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk in chunked(read_requests(lines), CHUNK_SIZE):
+            for invalid in [r for r in chunk if isinstance(r, InvalidRequest)]:
+                write_results(dict(invalid))
+            chunk = [r for r in chunk if not isinstance(r, InvalidRequest)]
+            prefetcher(clients, chunk)
+            for request in chunk:
+                if len(in_flight) >= 2 * workers:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        write(future)
+                        del in_flight[future]
+                future = executor.submit(
+                    handler, clients, request, platform_timeouts, total_timeout
+                )
+                in_flight[future] = request
+                count += 1
+
+        for future in as_completed(in_flight):
+            write(future)
+
+    return count, time.monotonic() - start
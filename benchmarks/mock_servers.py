@@ -0,0 +1,393 @@
+"""
+Local stand-ins for every platform's HTTP endpoints, used by offline_bench.
+Each platform gets its own server with configurable latency, 5xx and 429
+rates. Responses are built from payloads found in the response cache, so
+they have the same shape as the real services.
+"""
+
+import html
+import json
+import lzma
+import multiprocessing
+import os
+import pickle
+import random
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from requests.adapters import HTTPAdapter
+
+from lib.cache_codecs import decode
+
+# Host each platform's client talks to, redirected to its mock server
+PLATFORM_HOSTS = {
+    "instagram": ["i.instagram.com"],
+    "reddit": ["oauth.reddit.com", "www.reddit.com"],
+    "youtube": ["www.googleapis.com"],
+    "twitter": ["api.twitter.com"],
+    "linkedin": ["www.linkedin.com"],
+}
+# Usernames starting with this are answered with the platform's "not found"
+MISSING_PREFIX = "missing"
+
+# Used when the cache holds no payload for a platform
+DEFAULT_SEEDS = {
+    "instagram": {
+        "id": "1",
+        "username": "user",
+        "full_name": "Mock User",
+        "biography": "Mock biography",
+        "profile_pic_url": "https://example.com/pic.jpg",
+        "edge_followed_by": {"count": 1000},
+        "edge_follow": {"count": 100},
+        "edge_owner_to_timeline_media": {"count": 10},
+    },
+    "reddit": {
+        "name": "user",
+        "id": "abc123",
+        "created_utc": 1500000000.0,
+        "is_employee": False,
+        "is_mod": True,
+    },
+    "youtube": {
+        "kind": "youtube#channel",
+        "id": "UC0000000000000000000000",
+        "snippet": {"title": "Mock Channel", "description": "", "country": "US"},
+        "contentDetails": {"relatedPlaylists": {"uploads": "UU0"}},
+        "statistics": {"subscriberCount": "1000", "viewCount": "10", "videoCount": "1"},
+        "status": {"privacyStatus": "public", "isLinked": True},
+    },
+    "twitter": {
+        "id": 1,
+        "name": "Mock User",
+        "username": "user",
+        "location": "Somewhere",
+        "description": "Mock bio",
+        "followers_count": 1000,
+        "following_count": 100,
+        "tweet_count": 10,
+    },
+    "linkedin": {
+        "name": "Mock User",
+        "bio": "Mock bio",
+        "followers": 1000,
+        "connections": "500+ connections",
+        "address": "Somewhere",
+    },
+}
+
+
+def classify_payload(value):
+    """Guess which platform a cached value came from by its keys"""
+    if not isinstance(value, dict):
+        return None
+    if value.get("kind") == "youtube#channel":
+        return "youtube"
+    if "subreddit" in value and "is_employee" in value:
+        return "reddit"
+    if "biography" in value and "edge_followed_by" in value:
+        return "instagram"
+    if "tweet_count" in value and "followers_count" in value:
+        return "twitter"
+    if {"name", "followers", "connections", "address"} <= set(value):
+        return "linkedin"
+    return None
+
+
+def load_seeds(cache_dir="./cache"):
+    """
+    Pick one payload per platform from a directory cache, in any cache codec,
+    falling back to DEFAULT_SEEDS for platforms without one.
+    """
+    seeds = dict(DEFAULT_SEEDS)
+    try:
+        names = sorted(os.listdir(cache_dir))
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        try:
+            with open(os.path.join(cache_dir, name), "rb") as f:
+                value = decode(f.read())
+        except (
+            OSError,
+            EOFError,
+            pickle.UnpicklingError,
+            ValueError,
+            zlib.error,
+            lzma.LZMAError,
+        ):
+            continue
+        platform = classify_payload(value)
+        if platform and seeds[platform] is DEFAULT_SEEDS[platform]:
+            seeds[platform] = value
+    return seeds
+
+
+@dataclass
+class Behavior:
+    latency: float = 0.05
+    jitter: float = 0.02
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    retry_after: float = 1.0
+
+
+def linkedin_page(profile):
+    """A public profile page matching LinkedInScraper.selectors"""
+    followers = profile.get("followers")
+    text = lambda key: html.escape(str(profile.get(key) or ""))
+    # Profiles without an about section have no summary at all
+    summary = (
+        '<section class="summary"><div class="core-section-container__content">'
+        f'<p>{text("bio")}</p></div></section>'
+        if profile.get("bio")
+        else ""
+    )
+    return f"""<!DOCTYPE html>
+<html><body>
+<section class="top-card-layout">
+  <h1 class="top-card-layout__title">{text("name")}</h1>
+  <div class="profile-info-subheader">
+    <div>{text("address")}</div>
+    <div></div>
+    <div><span>{followers or 0} followers</span><span>{text("connections")}</span></div>
+  </div>
+</section>
+{summary}
+</body></html>"""
+
+
+def make_handler(platform, seed, behavior, rng):
+    rng_lock = threading.Lock()
+
+    def roll():
+        with rng_lock:
+            return rng.random(), rng.random(), rng.random()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are separate writes, Nagle would delay the body
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            pass
+
+        def reply(self, status, body, content_type="application/json", headers=None):
+            data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def handle_request(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+
+            spread, throttle, error = roll()
+            delay = behavior.latency + behavior.jitter * (2 * spread - 1)
+            time.sleep(max(delay, 0))
+            if throttle < behavior.throttle_rate:
+                reset = time.time() + behavior.retry_after
+                return self.reply(
+                    429,
+                    {"error": "Too Many Requests"},
+                    headers={
+                        "Retry-After": f"{behavior.retry_after:g}",
+                        "x-rate-limit-reset": str(int(reset) + 1),
+                    },
+                )
+            if error < behavior.error_rate:
+                return self.reply(500, {"error": "Internal Server Error"})
+
+            url = urlsplit(self.path)
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            status, body = route(url.path, query)
+            content_type = "text/html" if isinstance(body, str) else "application/json"
+            self.reply(status, body, content_type)
+
+        do_GET = handle_request
+        do_POST = handle_request
+
+    def route(path, query):
+        parts = [part for part in path.split("/") if part]
+        if platform == "instagram":
+            username = query.get("username", "")
+            if username.startswith(MISSING_PREFIX):
+                return 404, {"status": "fail"}
+            return 200, {"data": {"user": {**seed, "username": username}}}
+
+        if platform == "reddit":
+            if parts[-1:] == ["access_token"]:
+                return 200, {
+                    "access_token": "mock",
+                    "token_type": "bearer",
+                    "expires_in": 86400,
+                }
+            if len(parts) == 3 and parts[0] == "user" and parts[2] == "about":
+                if parts[1].startswith(MISSING_PREFIX):
+                    return 404, {"message": "Not Found", "error": 404}
+                return 200, {"kind": "t2", "data": {**seed, "name": parts[1]}}
+
+        if platform == "youtube":
+            endpoint = parts[-1] if parts else ""
+            if endpoint == "search":
+                q = query.get("q", "")
+                if q.startswith(MISSING_PREFIX):
+                    return 200, {"items": []}
+                return 200, {"items": [{"snippet": {"channelId": f"UC{q}"}}]}
+            if endpoint == "channels":
+                names = query.get("forHandle") or query.get("forUsername")
+                ids = [names] if names else query.get("id", "").split(",")
+                ids = [i for i in ids if i and not i.startswith(MISSING_PREFIX)]
+                return 200, {"items": [{**seed, "id": i} for i in ids]}
+
+        if platform == "twitter":
+            if parts[:3] == ["2", "users", "by"]:
+                if len(parts) == 5 and parts[3] == "username":
+                    usernames = [parts[4]]
+                else:
+                    usernames = query.get("usernames", "").split(",")
+                users = [
+                    twitter_user(seed, username)
+                    for username in usernames
+                    if username and not username.startswith(MISSING_PREFIX)
+                ]
+                if len(parts) == 5:
+                    if not users:
+                        return 200, {"errors": [{"title": "Not Found Error"}]}
+                    return 200, {"data": users[0]}
+                return 200, {"data": users}
+
+        if platform == "linkedin":
+            if len(parts) == 2 and parts[0] == "in":
+                if parts[1].startswith(MISSING_PREFIX):
+                    return 404, "<html><body>Not found</body></html>"
+                return 200, linkedin_page(seed)
+
+        return 404, {"error": f"No mock for {path}"}
+
+    return Handler
+
+
+def twitter_user(seed, username):
+    return {
+        "id": str(seed.get("id") or 1),
+        "name": seed.get("name"),
+        "username": username,
+        "location": seed.get("location"),
+        "description": seed.get("description"),
+        "public_metrics": {
+            "followers_count": seed.get("followers_count", 0),
+            "following_count": seed.get("following_count", 0),
+            "tweet_count": seed.get("tweet_count", 0),
+            "listed_count": 0,
+        },
+    }
+
+
+def serve(seeds, behavior, seed, ready):
+    """Run one server per platform until the process is terminated"""
+    servers = {}
+    for platform in PLATFORM_HOSTS:
+        rng = random.Random(f"{seed}-{platform}")
+        handler = make_handler(platform, seeds[platform], behavior, rng)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.daemon_threads = True
+        servers[platform] = server
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    ready.put(
+        {
+            platform: f"http://127.0.0.1:{server.server_address[1]}"
+            for platform, server in servers.items()
+        }
+    )
+    threading.Event().wait()
+
+
+class MockServers:
+    """
+    Start the mock servers in a child process, so their work does not count
+    towards the benchmarked process's CPU time or peak memory.
+    """
+
+    def __init__(self, seeds, behavior, seed=233):
+        self.seeds = seeds
+        self.behavior = behavior
+        self.seed = seed
+        self.urls = {}
+        self._process = None
+
+    def __enter__(self):
+        ready = multiprocessing.Queue()
+        self._process = multiprocessing.Process(
+            target=serve,
+            args=(self.seeds, self.behavior, self.seed, ready),
+            daemon=True,
+        )
+        self._process.start()
+        self.urls = ready.get(timeout=30)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._process.terminate()
+        self._process.join()
+
+    def routes(self):
+        """Real host to mock server base URL"""
+        return {
+            host: self.urls[platform]
+            for platform, hosts in PLATFORM_HOSTS.items()
+            for host in hosts
+        }
+
+
+class RedirectAdapter(HTTPAdapter):
+    """Send requests for the routed hosts to their mock servers instead"""
+
+    def __init__(self, routes, **kwargs):
+        self.routes = routes
+        super().__init__(**kwargs)
+
+    def send(self, request, *args, **kwargs):  # pylint: disable=arguments-differ
+        url = urlsplit(request.url)
+        if url.hostname in self.routes:
+            request.url = (
+                self.routes[url.hostname]
+                + request.url[len(f"{url.scheme}://{url.netloc}") :]
+            )
+        return super().send(request, *args, **kwargs)
+
+
+def redirect_session(session, routes):
+    """Mount a RedirectAdapter keeping the session's pool size and retries"""
+    current = session.get_adapter("https://")
+    adapter = RedirectAdapter(
+        routes,
+        pool_connections=current._pool_connections,
+        pool_maxsize=current._pool_maxsize,
+        max_retries=current.max_retries,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def redirect_clients(clients, routes):
+    """Point every client built by main.build_clients at the mock servers"""
+    for platform, client in clients.items():
+        if platform == "twitter":
+            redirect_session(client.client.session, routes)
+        else:
+            redirect_session(client.session, routes)
+    if "linkedin" in clients:
+        # There is no Chrome offline, and the mock page always renders server side
+        clients["linkedin"].mode = "http"
+    return clients
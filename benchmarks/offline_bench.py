@@ -0,0 +1,190 @@
+"""
+Measure latency, throughput and memory against local mock servers, without
+touching the real services or the repository's cache.
+Run from the repository root: python -m benchmarks.offline_bench --users 200
+"""
+
+import contextlib
+import json
+import os
+import resource
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import typer
+from typing_extensions import Annotated
+
+from benchmarks.mock_servers import (
+    MISSING_PREFIX,
+    PLATFORM_HOSTS,
+    Behavior,
+    MockServers,
+    load_seeds,
+    redirect_clients,
+)
+
+# Loose enough that the rate limiter never paces the benchmark
+UNLIMITED_RATE = "1000,1000,64"
+
+
+def summarize(latencies, elapsed):
+    """
+    Returns:
+        dict: Count, p50/p95/p99 latency in ms, users/s and peak RSS so far.
+    """
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = latencies[0] if latencies else 0
+    return {
+        "count": len(latencies),
+        "p50_ms": round(p50 * 1000, 1),
+        "p95_ms": round(p95 * 1000, 1),
+        "p99_ms": round(p99 * 1000, 1),
+        "users_per_second": round(len(latencies) / elapsed, 2) if elapsed else 0,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+    }
+
+
+def timed_map(fn, items, workers):
+    """Call fn on every item with a pool of workers, timing each call"""
+
+    def timed(item):
+        start = time.perf_counter()
+        try:
+            fn(item)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"An error occurred while benchmarking {item}: {e}")
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        latencies = list(executor.map(timed, items))
+    return latencies, time.perf_counter() - start
+
+
+def make_usernames(prefix, users, missing_rate):
+    """Unique usernames, so every call misses the cache, some of them not found"""
+    missing_every = round(1 / missing_rate) if missing_rate else 0
+    return [
+        (
+            f"{MISSING_PREFIX}{prefix}{i}"
+            if missing_every and i % missing_every == 0
+            else f"{prefix}{i}"
+        )
+        for i in range(users)
+    ]
+
+
+def main(
+    users: Annotated[int, typer.Option(help="Usernames per scenario")] = 100,
+    workers: Annotated[int, typer.Option(help="Concurrent lookups")] = 8,
+    latency: Annotated[
+        float, typer.Option(help="Mean mock server latency in seconds")
+    ] = 0.05,
+    jitter: Annotated[
+        float, typer.Option(help="Latency varies by up to this many seconds")
+    ] = 0.02,
+    error_rate: Annotated[
+        float, typer.Option(help="Fraction of requests answered with a 500")
+    ] = 0.0,
+    throttle_rate: Annotated[
+        float, typer.Option(help="Fraction of requests answered with a 429")
+    ] = 0.0,
+    retry_after: Annotated[
+        float, typer.Option(help="Retry-After of the 429 responses in seconds")
+    ] = 1.0,
+    missing_rate: Annotated[
+        float, typer.Option(help="Fraction of usernames that are not found")
+    ] = 0.1,
+    rate_limits: Annotated[
+        bool, typer.Option(help="Keep the real per-platform rate limits")
+    ] = False,
+    seed_cache: Annotated[
+        str, typer.Option(help="Directory cache the mock payloads are copied from")
+    ] = "./cache",
+    output_json: Annotated[
+        bool, typer.Option("--json", help="Print the results as JSON")
+    ] = False,
+    seed: Annotated[int, typer.Option(help="Random seed")] = 233,
+):
+    # Everything the run writes goes to a throwaway directory
+    workdir = tempfile.mkdtemp(prefix="offline-bench-")
+    os.environ["CACHE_BACKEND"] = "directory"
+    os.environ["CACHE_DIR"] = os.path.join(workdir, "cache")
+    os.environ["REDDIT_TOKEN_PATH"] = os.path.join(workdir, "reddit.json")
+    os.environ["YOUTUBE_QUOTA_PATH"] = os.path.join(workdir, "youtube_quota.json")
+    for name in (
+        "TWITTER_BEARER_TOKEN",
+        "YOUTUBE_API_KEY",
+        "REDDIT_CLIENT_ID",
+        "REDDIT_CLIENT_SECRET",
+    ):
+        os.environ[name] = "mock"
+    if not rate_limits:
+        for platform in PLATFORM_HOSTS:
+            os.environ[f"RATE_LIMIT_{platform.upper()}"] = UNLIMITED_RATE
+
+    # Imported after the environment is set, as the CLI would be
+    import main as cli
+    from lib.fetch import get_fetchers
+
+    behavior = Behavior(latency, jitter, error_rate, throttle_rate, retry_after)
+    results = {}
+    with MockServers(load_seeds(seed_cache), behavior, seed) as servers:
+        routes = servers.routes()
+        build_clients = cli.build_clients
+
+        def build_redirected_clients(**kwargs):
+            return redirect_clients(build_clients(**kwargs), routes)
+
+        with contextlib.redirect_stdout(open(os.devnull, "w", encoding="utf-8")):
+            clients = build_redirected_clients(pool_size=max(workers, 10))
+            for platform, fetch in get_fetchers(clients).items():
+                usernames = make_usernames(f"{platform}-", users, missing_rate)
+                results[f"client.{platform}"] = summarize(
+                    *timed_map(fetch, usernames, workers)
+                )
+
+            # The score command end to end, building its own clients per user
+            cli.build_clients = build_redirected_clients
+            try:
+                usernames = make_usernames("score-", users, missing_rate)
+                results["score"] = summarize(
+                    *timed_map(
+                        lambda username: cli.main(
+                            username,
+                            platform_timeout=None,
+                            timeout=cli.TOTAL_TIMEOUT,
+                        ),
+                        usernames,
+                        workers,
+                    )
+                )
+            finally:
+                cli.build_clients = build_clients
+
+    if output_json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(
+        f"{'scenario':18} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+        f"{'users/s':>8} {'peak RSS MB':>12}"
+    )
+    for name, result in results.items():
+        print(
+            f"{name:18} {result['count']:>6} {result['p50_ms']:>8} "
+            f"{result['p95_ms']:>8} {result['p99_ms']:>8} "
+            f"{result['users_per_second']:>8} {result['peak_rss_mb']:>12}"
+        )
+
+
+if __name__ == "__main__":
+    typer.run(main)
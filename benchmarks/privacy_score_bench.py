@@ -0,0 +1,91 @@
+"""
+Compare scalar scoring, bulk scoring from dicts, and rescoring saved exposure
+matrices, on random records.
+Run from the repository root: python -m benchmarks.privacy_score_bench --users 100000
+"""
+
+import os
+import random
+import tempfile
+import time
+
+import typer
+from typing_extensions import Annotated
+
+from privacy_score import (
+    WEIGHTS,
+    build_exposure_matrices,
+    calculate_overall_privacy_score,
+    calculate_privacy_scores,
+    load_exposure_matrices,
+    save_exposure_matrices,
+    score_exposure_matrices,
+)
+
+# "other" has no weights, like a platform added before it is scored
+PLATFORMS = list(WEIGHTS) + ["other"]
+
+
+def random_record(rng):
+    all_user_info = {}
+    for platform in PLATFORMS:
+        if rng.random() < 0.3:
+            all_user_info[platform] = None
+            continue
+        fields = WEIGHTS.get(platform, {"name": 1})
+        all_user_info[platform] = {
+            field: rng.choice([None, "", 0, 1, "value", {"count": 1}])
+            for field in fields
+        }
+    return all_user_info
+
+
+def main(
+    users: Annotated[
+        int, typer.Option(help="Number of random users to score")
+    ] = 100_000,
+    seed: Annotated[int, typer.Option(help="Random seed")] = 233,
+):
+    rng = random.Random(seed)
+    records = [random_record(rng) for _ in range(users)]
+
+    start = time.perf_counter()
+    scalar = [calculate_overall_privacy_score(record) for record in records]
+    scalar_seconds = time.perf_counter() - start
+
+    # numpy is imported on first use, keep that out of the timing
+    calculate_privacy_scores(records[:1])
+    start = time.perf_counter()
+    bulk = calculate_privacy_scores(records)
+    bulk_seconds = time.perf_counter() - start
+
+    # Rescoring after a weight change only loads the saved matrices and repeats
+    # the array operations
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "matrices.npz")
+        save_exposure_matrices(path, *build_exposure_matrices(records))
+        start = time.perf_counter()
+        rescored = score_exposure_matrices(
+            *load_exposure_matrices(path), weights=WEIGHTS
+        )
+        rescore_seconds = time.perf_counter() - start
+
+    mismatches = sum(1 for a, b in zip(scalar, bulk) if a != b)
+    mismatches += sum(1 for a, b in zip(scalar, rescored) if a != b)
+    print(f"users:   {users}")
+    for name, seconds in [
+        ("scalar", scalar_seconds),
+        ("bulk", bulk_seconds),
+        ("rescore", rescore_seconds),
+    ]:
+        print(
+            f"{name + ':':8} {seconds:.3f}s ({users / seconds:,.0f} users/s, "
+            f"{scalar_seconds / seconds:.1f}x)"
+        )
+    print(f"mismatches: {mismatches}")
+    if mismatches:
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
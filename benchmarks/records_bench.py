@@ -0,0 +1,111 @@
+"""
+Compare the memory held by normalized profiles as dicts, slotted records and
+column batches, and check that scoring from columns matches the scalar scores.
+Run from the repository root: python -m benchmarks.records_bench --users 100000
+"""
+
+import random
+import time
+import tracemalloc
+
+import typer
+from typing_extensions import Annotated
+
+from models.normalized_data import RECORD_TYPES, batches_from_all_data, field_types
+from privacy_score import (
+    calculate_overall_privacy_score,
+    exposure_matrices_from_batches,
+    score_exposure_matrices,
+)
+
+
+def random_value(rng, field_type, i):
+    if rng.random() < 0.3:
+        return None
+    if field_type is int:
+        return rng.choice([0, rng.randrange(10**6)])
+    if field_type is float:
+        return rng.uniform(1.1e9, 1.7e9)
+    if field_type is bool:
+        return rng.random() < 0.5
+    if field_type is dict:
+        return {"subscriber_count": str(rng.randrange(10**6))}
+    return rng.choice(["", f"value {i}"])
+
+
+def random_all_data(rng, i):
+    all_data = {}
+    for platform, record_type in RECORD_TYPES.items():
+        if rng.random() < 0.3:
+            all_data[platform] = None
+            continue
+        all_data[platform] = record_type(
+            **{
+                field: random_value(rng, field_type, i)
+                for field, field_type in field_types(record_type).items()
+            }
+        )
+    return all_data
+
+
+def measure(build):
+    tracemalloc.start()
+    value = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, size
+
+
+def main(
+    users: Annotated[int, typer.Option(help="Number of random users")] = 100_000,
+    seed: Annotated[int, typer.Option(help="Random seed")] = 233,
+):
+    rng = random.Random(seed)
+    source = [random_all_data(rng, i) for i in range(users)]
+
+    dicts, dict_bytes = measure(
+        lambda: [
+            {p: r.to_dict() if r else None for p, r in all_data.items()}
+            for all_data in source
+        ]
+    )
+    records, record_bytes = measure(
+        lambda: [
+            {p: type(r).from_dict(r.to_dict()) if r else None for p, r in d.items()}
+            for d in source
+        ]
+    )
+    batches, batch_bytes = measure(lambda: batches_from_all_data(dicts))
+
+    start = time.perf_counter()
+    scalar = [calculate_overall_privacy_score(all_data) for all_data in dicts]
+    scalar_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    columnar = score_exposure_matrices(*exposure_matrices_from_batches(batches))
+    columnar_seconds = time.perf_counter() - start
+
+    print(f"users:   {users}")
+    for name, size in [
+        ("dicts", dict_bytes),
+        ("records", record_bytes),
+        ("batches", batch_bytes),
+    ]:
+        print(
+            f"{name + ':':8} {size / 2**20:7.1f} MB ({size / users:,.0f} bytes/user, "
+            f"{dict_bytes / size:.1f}x smaller than dicts)"
+        )
+    print(f"scalar scoring:   {scalar_seconds:.3f}s")
+    print(f"columnar scoring: {columnar_seconds:.3f}s")
+    mismatches = sum(1 for a, b in zip(scalar, columnar) if a != b)
+    mismatches += sum(
+        1
+        for a, b in zip(dicts, (calculate_overall_privacy_score(r) for r in records))
+        if calculate_overall_privacy_score(a) != b
+    )
+    print(f"mismatches: {mismatches}")
+    if mismatches:
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
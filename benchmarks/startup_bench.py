@@ -0,0 +1,85 @@
+"""
+Measure CLI cold start: importing main, printing --help and building the
+clients of one platform, each in a fresh interpreter, plus the slowest imports.
+Run from the repository root: python -m benchmarks.startup_bench --max-import-ms 500
+"""
+
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+import typer
+from typing_extensions import Annotated
+
+BUILD_ONE = "from main import build_clients; build_clients(platforms=[{platform!r}])"
+
+
+def run_seconds(args):
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, *args],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+
+def median_ms(args, runs):
+    return statistics.median(run_seconds(args) for _ in range(runs)) * 1000
+
+
+def slowest_imports(count):
+    """Modules imported directly by main, by cumulative microseconds"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    imports = []
+    for line in stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)", line)
+        # main's own imports are indented one level under it
+        if match and len(match.group(2)) == 2:
+            imports.append((int(match.group(1)), match.group(3)))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main(
+    runs: Annotated[int, typer.Option(help="Runs of each command")] = 5,
+    platform: Annotated[
+        str, typer.Option(help="Platform whose client is built")
+    ] = "reddit",
+    top: Annotated[int, typer.Option(help="Slowest imports to list")] = 10,
+    max_import_ms: Annotated[
+        float,
+        typer.Option(help="Exit with status 1 when `import main` is slower than this"),
+    ] = None,
+):
+    import_ms = median_ms(["-c", "import main"], runs)
+    baseline_ms = median_ms(["-c", "pass"], runs)
+    print(f"interpreter:           {baseline_ms:7.1f}ms")
+    print(f"import main:           {import_ms:7.1f}ms")
+    print(f"main.py --help:        {median_ms(['main.py', '--help'], runs):7.1f}ms")
+    print(
+        f"build {platform} client: "
+        f"{median_ms(['-c', BUILD_ONE.format(platform=platform)], runs):7.1f}ms"
+    )
+
+    print("\nslowest imports of main:")
+    for microseconds, module in slowest_imports(top):
+        print(f"{microseconds / 1000:8.1f}ms {module}")
+
+    if max_import_ms is not None and import_ms - baseline_ms > max_import_ms:
+        print(
+            f"\nimport main took {import_ms - baseline_ms:.1f}ms over the interpreter, "
+            f"more than {max_import_ms:.0f}ms"
+        )
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
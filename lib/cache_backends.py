@@ -0,0 +1,435 @@
+import atexit
+import contextlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows, where processes are not coordinated
+    fcntl = None
+
+DEFAULT_CACHE_DIR = "./cache"
+DEFAULT_CACHE_DB = "./cache.sqlite3"
+# Temp files older than this were left behind by a crashed writer
+STALE_TEMP_AGE = 60 * 60
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """
+    Hold an exclusive lock on path across processes. The lock file is removed
+    on release, so a waiter that locked a removed file tries again.
+    """
+    if fcntl is None:
+        yield
+        return
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    while True:
+        fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            current = os.stat(path).st_ino == os.fstat(fd).st_ino
+        except FileNotFoundError:
+            current = False
+        if current:
+            break
+        os.close(fd)
+    try:
+        yield
+    finally:
+        _remove(path)
+        os.close(fd)
+
+
+class DirectoryBackend:
+    """One file per key in a flat directory, the original cache layout"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def lock_path(self, key):
+        return os.path.join(self.cache_dir, ".locks", key)
+
+    def get(self, key, touch=True):
+        """
+        Args:
+            touch (bool): Record the access for LRU eviction.
+        Returns:
+            tuple: (data, created_at) or None when the key is not cached.
+        """
+        path = self.path(key)
+        try:
+            stat = os.stat(path)
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        # Record the access for LRU eviction without touching the creation time
+        if touch:
+            try:
+                os.utime(path, (time.time(), stat.st_mtime))
+            except FileNotFoundError:
+                pass
+        return data, stat.st_mtime
+
+    def set(self, key, data, func_name=None, created_at=None, accessed_at=None):
+        """
+        Write atomically so readers never see a partially written entry.
+        created_at and accessed_at keep an existing entry's age and LRU position
+        when it is rewritten.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            if created_at is not None:
+                os.utime(tmp_path, (accessed_at or created_at, created_at))
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            _remove(tmp_path)
+            raise
+
+    def delete(self, key):
+        _remove(self.path(key))
+
+    def entries(self):
+        """Yield (key, size, created_at, accessed_at) for every entry"""
+        now = time.time()
+        try:
+            it = os.scandir(self.cache_dir)
+        except FileNotFoundError:
+            return
+        with it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if entry.name.startswith(".tmp"):
+                    if now - stat.st_mtime > STALE_TEMP_AGE:
+                        _remove(entry.path)
+                    continue
+                yield entry.name, stat.st_size, stat.st_mtime, stat.st_atime
+
+    def evict(self, max_bytes, max_entries):
+        """
+        Remove least recently used entries until the cache is within its caps.
+        Returns:
+            int: Number of entries removed.
+        """
+        entries = sorted(self.entries(), key=lambda entry: entry[3])
+        total_bytes = sum(entry[1] for entry in entries)
+        remaining = len(entries)
+        removed = 0
+        for key, size, _, _ in entries:
+            if total_bytes <= max_bytes and remaining <= max_entries:
+                break
+            self.delete(key)
+            total_bytes -= size
+            remaining -= 1
+            removed += 1
+        return removed
+
+    def cleanup(self, max_age):
+        """Remove entries created more than max_age seconds ago"""
+        cutoff = time.time() - max_age
+        removed = 0
+        for key, _, created_at, _ in list(self.entries()):
+            if created_at < cutoff:
+                self.delete(key)
+                removed += 1
+        return removed
+
+    def stats(self):
+        entries = list(self.entries())
+        return {
+            "backend": "directory",
+            "location": self.cache_dir,
+            "entries": len(entries),
+            "bytes": sum(entry[1] for entry in entries),
+        }
+
+
+class SQLiteBackend:
+    """
+    All entries in a single SQLite file, indexed by key and access time.
+    One connection is shared by every thread of the process. Writes and LRU
+    access updates are buffered and committed together every FLUSH_SIZE changes
+    or FLUSH_INTERVAL seconds, and on exit.
+    """
+
+    FLUSH_SIZE = 100
+    FLUSH_INTERVAL = 1.0
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY,
+            func_name TEXT,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            size INTEGER NOT NULL,
+            value BLOB NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at);
+        CREATE INDEX IF NOT EXISTS cache_func_name ON cache (func_name);
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._connection = None
+        self._pid = None
+        self._pending_writes = {}
+        self._pending_touches = {}
+        self._last_flush = time.monotonic()
+        atexit.register(self.flush)
+
+    def lock_path(self, key):
+        return os.path.join(f"{self.db_path}.locks", key)
+
+    @property
+    def connection(self):
+        # A connection must not be shared with a forked child
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(
+                self.db_path, timeout=30, check_same_thread=False
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(self.SCHEMA)
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key, touch=True):
+        """
+        Args:
+            touch (bool): Record the access for LRU eviction.
+        Returns:
+            tuple: (data, created_at) or None when the key is not cached.
+        """
+        with self._lock:
+            if key in self._pending_writes:
+                _, created_at, data, _ = self._pending_writes[key]
+                return data, created_at
+
+            row = self.connection.execute(
+                "SELECT value, created_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if touch:
+                self._pending_touches[key] = time.time()
+                self._maybe_flush()
+            return bytes(row[0]), row[1]
+
+    def set(self, key, data, func_name=None, created_at=None, accessed_at=None):
+        """
+        created_at and accessed_at keep an existing entry's age and LRU position
+        when it is rewritten.
+        """
+        created_at = created_at or time.time()
+        with self._lock:
+            self._pending_writes[key] = (
+                func_name,
+                created_at,
+                data,
+                accessed_at or created_at,
+            )
+            self._pending_touches.pop(key, None)
+            self._maybe_flush()
+
+    def set_many(self, rows):
+        """Insert (key, data, func_name, created_at, accessed_at) rows in one transaction"""
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO cache "
+                "(key, func_name, created_at, accessed_at, size, value) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (key, func_name, created_at, accessed_at, len(data), data)
+                    for key, data, func_name, created_at, accessed_at in rows
+                ],
+            )
+
+    def delete(self, key):
+        with self._lock:
+            self._pending_writes.pop(key, None)
+            self._pending_touches.pop(key, None)
+            with self.connection:
+                self.connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def entries(self):
+        """Yield (key, size, created_at, accessed_at) for every entry"""
+        with self._lock:
+            self.flush()
+            rows = self.connection.execute(
+                "SELECT key, size, created_at, accessed_at FROM cache"
+            ).fetchall()
+        yield from rows
+
+    def _maybe_flush(self):
+        pending = len(self._pending_writes) + len(self._pending_touches)
+        if (
+            pending >= self.FLUSH_SIZE
+            or time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL
+        ):
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._pending_writes and not self._pending_touches:
+                return
+            writes = [
+                (key, data, func_name, created_at, accessed_at)
+                for key, (
+                    func_name,
+                    created_at,
+                    data,
+                    accessed_at,
+                ) in self._pending_writes.items()
+            ]
+            touches = [
+                (accessed_at, key) for key, accessed_at in self._pending_touches.items()
+            ]
+            self._pending_writes = {}
+            self._pending_touches = {}
+            self.set_many(writes)
+            with self.connection:
+                self.connection.executemany(
+                    "UPDATE cache SET accessed_at = ? WHERE key = ?", touches
+                )
+
+    def evict(self, max_bytes, max_entries):
+        """
+        Remove least recently used entries until the cache is within its caps.
+        Returns:
+            int: Number of entries removed.
+        """
+        with self._lock:
+            self.flush()
+            entries, total_bytes = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache"
+            ).fetchone()
+            if total_bytes <= max_bytes and entries <= max_entries:
+                return 0
+
+            victims = []
+            for key, size in self.connection.execute(
+                "SELECT key, size FROM cache ORDER BY accessed_at"
+            ):
+                if total_bytes <= max_bytes and entries <= max_entries:
+                    break
+                victims.append((key,))
+                total_bytes -= size
+                entries -= 1
+            with self.connection:
+                self.connection.executemany("DELETE FROM cache WHERE key = ?", victims)
+            return len(victims)
+
+    def cleanup(self, max_age):
+        """Remove entries created more than max_age seconds ago"""
+        with self._lock:
+            self.flush()
+            with self.connection:
+                cursor = self.connection.execute(
+                    "DELETE FROM cache WHERE created_at < ?", (time.time() - max_age,)
+                )
+            return cursor.rowcount
+
+    def stats(self):
+        with self._lock:
+            self.flush()
+            rows = self.connection.execute(
+                "SELECT func_name, COUNT(*), SUM(size), MIN(created_at) "
+                "FROM cache GROUP BY func_name"
+            ).fetchall()
+        return {
+            "backend": "sqlite",
+            "location": self.db_path,
+            "entries": sum(row[1] for row in rows),
+            "bytes": sum(row[2] for row in rows),
+            "functions": {
+                func_name
+                or "unknown": {
+                    "entries": count,
+                    "bytes": size,
+                    "oldest": oldest,
+                }
+                for func_name, count, size, oldest in rows
+            },
+        }
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(kind=None, location=None):
+    """
+    Return the shared backend instance for this process.
+    Args:
+        kind (str): "directory" or "sqlite", defaults to $CACHE_BACKEND or directory.
+        location (str): Directory or database path, defaults to $CACHE_DIR / $CACHE_DB.
+    """
+    kind = kind or os.getenv("CACHE_BACKEND", "directory")
+    if kind == "directory":
+        location = location or os.getenv("CACHE_DIR", DEFAULT_CACHE_DIR)
+        backend_class = DirectoryBackend
+    elif kind == "sqlite":
+        location = location or os.getenv("CACHE_DB", DEFAULT_CACHE_DB)
+        backend_class = SQLiteBackend
+    else:
+        raise ValueError(f"Unknown cache backend: {kind}")
+
+    with _backends_lock:
+        if (kind, location) not in _backends:
+            _backends[(kind, location)] = backend_class(location)
+        return _backends[(kind, location)]
+
+
+def migrate_directory_to_sqlite(cache_dir=None, db_path=None, batch_size=500):
+    """
+    Import every entry of a directory cache into a SQLite cache, keeping keys,
+    creation and access times. Existing keys in the database are overwritten.
+    Returns:
+        int: Number of entries imported.
+    """
+    source = DirectoryBackend(cache_dir or os.getenv("CACHE_DIR", DEFAULT_CACHE_DIR))
+    target = get_backend("sqlite", db_path)
+
+    imported = 0
+    rows = []
+    for key, _, created_at, accessed_at in source.entries():
+        try:
+            with open(source.path(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            continue
+        rows.append((key, data, None, created_at, accessed_at))
+        if len(rows) >= batch_size:
+            target.set_many(rows)
+            imported += len(rows)
+            rows = []
+    if rows:
+        target.set_many(rows)
+        imported += len(rows)
+    return imported
@@ -0,0 +1,96 @@
+import json
+import lzma
+import os
+import pickle
+import zlib
+
+# Encoded entries start with MAGIC, a codec byte and a serializer byte. Anything
+# else is a raw pickle written before codecs existed.
+MAGIC = b"\x00fc"
+CODECS = {
+    "none": (b"n", lambda data: data, lambda data: data),
+    "zlib": (b"z", lambda data: zlib.compress(data, 6), zlib.decompress),
+    "lzma": (b"x", lzma.compress, lzma.decompress),
+}
+SERIALIZERS = {"pickle": b"p", "json": b"j"}
+DEFAULT_CODEC = "zlib"
+DEFAULT_SERIALIZER = "pickle"
+
+
+def get_codec():
+    """Codec and serializer for new entries, from $CACHE_CODEC and $CACHE_SERIALIZER"""
+    codec = os.getenv("CACHE_CODEC", DEFAULT_CODEC)
+    serializer = os.getenv("CACHE_SERIALIZER", DEFAULT_SERIALIZER)
+    if codec not in CODECS:
+        raise ValueError(f"Unknown cache codec: {codec}")
+    if serializer not in SERIALIZERS:
+        raise ValueError(f"Unknown cache serializer: {serializer}")
+    return codec, serializer
+
+
+def encode(value, codec=None, serializer=None):
+    """
+    Serialize and compress a value for the cache. The json serializer never runs
+    code on load, values it cannot represent exactly fall back to pickle.
+    """
+    default_codec, default_serializer = get_codec()
+    codec = codec or default_codec
+    serializer = serializer or default_serializer
+
+    data = None
+    if serializer == "json":
+        try:
+            data = json.dumps(value, separators=(",", ":"), allow_nan=False).encode()
+            if json.loads(data) != value:
+                data = None
+        except (TypeError, ValueError):
+            data = None
+        if data is None:
+            serializer = "pickle"
+    if data is None:
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    codec_id, compress, _ = CODECS[codec]
+    return MAGIC + codec_id + SERIALIZERS[serializer] + compress(data)
+
+
+def decode(data):
+    """Inverse of encode, also reading raw pickles"""
+    if not data.startswith(MAGIC):
+        return pickle.loads(data)
+
+    codec_id, serializer_id = data[3:4], data[4:5]
+    for known_id, _, decompress in CODECS.values():
+        if known_id == codec_id:
+            break
+    else:
+        raise ValueError(f"Unknown cache codec id: {codec_id!r}")
+    payload = decompress(data[5:])
+    if serializer_id == SERIALIZERS["json"]:
+        return json.loads(payload)
+    if serializer_id == SERIALIZERS["pickle"]:
+        return pickle.loads(payload)
+    raise ValueError(f"Unknown cache serializer id: {serializer_id!r}")
+
+
+def project(value, fields):
+    """
+    Keep only the listed fields of a dict. Dotted paths select nested fields,
+    e.g. "edge_followed_by.count". Missing fields are left out.
+    """
+    if not isinstance(value, dict):
+        return value
+    nested = {}
+    for field in fields:
+        head, _, rest = field.partition(".")
+        nested.setdefault(head, []).append(rest)
+
+    result = {}
+    for head, rests in nested.items():
+        if head not in value:
+            continue
+        if all(rests):
+            result[head] = project(value[head], rests)
+        else:
+            result[head] = value[head]
+    return result
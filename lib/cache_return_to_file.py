@@ -1,28 +1,593 @@
+import atexit
+import contextlib
+import functools
+import inspect
+import json
+import lzma
 import os
 import pickle
 import hashlib
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import Future
+from datetime import timedelta
 
+from lib.cache_backends import file_lock, get_backend
+from lib.cache_codecs import decode, encode, project
+from lib.metrics import metrics
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 100_000
+DEFAULT_MEMORY_ENTRIES = 1024
+# "Not found" results are cached for this long unless a decorator sets negative_ttl
+DEFAULT_NEGATIVE_TTL = 60 * 60
+# Walking the cache is expensive, so the caps are only enforced every N writes
+EVICT_EVERY = 100
+# Seconds the process waits at exit for background refreshes to finish
+REFRESH_EXIT_TIMEOUT = 10
+
+# Argument names and dict keys that hold credentials and never form part of a key
+SECRET_PARAMS = {"key", "token", "access_token", "bearer_token", "client_secret"}
+
+_evict_lock = threading.Lock()
+_writes_since_evict = 0
+_counters = defaultdict(Counter)
+_counters_lock = threading.Lock()
+# (backend, key) to the Future of the call computing it in this process
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+# Cached function name to the fields it keeps, for compact_cache
+_projections = {}
+# (backend, key) to the thread refreshing that entry in the background
+_refreshing = {}
+_refreshing_lock = threading.Lock()
+_wait_registered = False
+# Per thread, the names of cached functions that served stale or failed calls
+_stale_reads = threading.local()
+_failed_calls = threading.local()
+# Serve entries past their soft_ttl while they are refreshed in the background.
+# Off, such entries are refreshed before they are returned, as in prefetch.
+_serve_stale = True
+
+
+class _Uncached:
+    def __init__(self, value):
+        self.value = value
+
+
+def uncached(value):
+    """
+    Return value from a cached function without storing it, e.g. the None
+    returned after a failed request, so a transient error is retried next call.
+    """
+    return _Uncached(value)
+
+
+class MemoryCache:
+    """Thread-safe in-process LRU of decoded values in front of the backend"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns:
+            tuple: (value, created_at) or None when the key is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, created_at):
+        with self._lock:
+            self._entries[key] = (value, created_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+memory_cache = MemoryCache(
+    int(os.getenv("CACHE_MEMORY_ENTRIES", str(DEFAULT_MEMORY_ENTRIES)))
+)
+
+
+def get_cache_limits():
+    """Global caps shared by every cached function, read from the environment"""
+    max_bytes = int(os.getenv("CACHE_MAX_BYTES", str(DEFAULT_MAX_BYTES)))
+    max_entries = int(os.getenv("CACHE_MAX_ENTRIES", str(DEFAULT_MAX_ENTRIES)))
+    return max_bytes, max_entries
+
+
+def evict(backend=None, max_bytes=None, max_entries=None):
+    """
+    Remove least recently used entries until the cache is within its caps.
+    Returns:
+        int: Number of entries removed.
+    """
+    backend = backend or get_backend()
+    default_bytes, default_entries = get_cache_limits()
+    return backend.evict(
+        default_bytes if max_bytes is None else max_bytes,
+        default_entries if max_entries is None else max_entries,
+    )
+
+
+def _maybe_evict(backend):
+    global _writes_since_evict
+    with _evict_lock:
+        _writes_since_evict += 1
+        if _writes_since_evict < EVICT_EVERY:
+            return
+        _writes_since_evict = 0
+        evict(backend)
+
+
+def _read(backend, key):
+    """
+    Returns:
+        tuple: (value, created_at) or None when the key is missing or unreadable.
+    """
+    entry = backend.get(key)
+    if entry is None:
+        return None
+
+    data, created_at = entry
+    try:
+        return decode(data), created_at
+    except (
+        EOFError,
+        pickle.UnpicklingError,
+        ValueError,
+        zlib.error,
+        lzma.LZMAError,
+    ) as e:
+        print(f"Discarding unreadable cache entry {key}: {e}")
+        backend.delete(key)
+        return None
+
+
+def _freshness(value, created_at, ttl, negative_ttl, soft_ttl):
+    """
+    Returns:
+        str: "fresh", "stale" when past soft_ttl but not ttl, or "expired".
+    """
+    age = time.time() - created_at
+    max_age = negative_ttl if value is None else ttl
+    if max_age is not None and age > max_age:
+        return "expired"
+    if value is not None and soft_ttl is not None and age > soft_ttl:
+        return "stale"
+    return "fresh"
+
+
+def set_serve_stale(enabled):
+    """Whether entries past their soft_ttl are returned while they refresh"""
+    global _serve_stale
+    _serve_stale = enabled
+
+
+@contextlib.contextmanager
+def _collect(local):
+    previous = getattr(local, "names", None)
+    local.names = names = set()
+    try:
+        yield names
+    finally:
+        local.names = previous
+
+
+def _note(local, func_name):
+    names = getattr(local, "names", None)
+    if names is not None:
+        names.add(func_name)
+
+
+def stale_reads():
+    """
+    Collect the names of the cached functions that returned a stale entry in
+    this thread within the block.
+    """
+    return _collect(_stale_reads)
+
+
+def failed_calls():
+    """
+    Collect the names of the cached functions that returned an uncached()
+    result, i.e. failed, in this thread within the block. Threads waiting for
+    the same call count it too.
+    """
+    return _collect(_failed_calls)
+
+
+def revalidate(storage, key, refresh, func_name):
+    """
+    Run refresh in a background thread, unless the key is already being
+    refreshed in this process. The process waits for it at exit, see
+    wait_for_refreshes.
+    """
+    global _wait_registered
+    flight = (id(storage), key)
+
+    def target():
+        try:
+            refresh()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"An error occurred while refreshing {key}: {e}")
+        finally:
+            with _refreshing_lock:
+                _refreshing.pop(flight, None)
+
+    with _refreshing_lock:
+        if flight in _refreshing:
+            metrics.inc("cache_coalesced_total", function=func_name)
+            return
+        # Registered now rather than on import, so that it runs before the exit
+        # hooks of the backends and browsers the refreshes still use
+        if not _wait_registered:
+            atexit.register(wait_for_refreshes)
+            _wait_registered = True
+        thread = _refreshing[flight] = threading.Thread(target=target, daemon=True)
+        thread.start()
+
+
+def wait_for_refreshes(timeout=REFRESH_EXIT_TIMEOUT):
+    """
+    Wait up to timeout seconds in total for the background refreshes started
+    by revalidate, which would otherwise be killed with the process.
+    Returns:
+        int: The number of refreshes still running.
+    """
+    deadline = time.monotonic() + timeout
+    with _refreshing_lock:
+        threads = list(_refreshing.values())
+    for thread in threads:
+        thread.join(max(deadline - time.monotonic(), 0))
+    running = sum(thread.is_alive() for thread in threads)
+    if running:
+        print(f"Gave up waiting for {running} background cache refreshes")
+    return running
+
+
+def single_flight(storage, key, compute, func_name, count=True):
+    """
+    Run compute once per key at a time in this process. Threads asking for a
+    key that is already being computed wait for that result instead, and are
+    counted as coalesced when count is set.
+    """
+    flight = (id(storage), key)
+    with _in_flight_lock:
+        future = _in_flight.get(flight)
+        leader = future is None
+        if leader:
+            future = _in_flight[flight] = Future()
+    if not leader:
+        metrics.inc("cache_coalesced_total", function=func_name)
+        if count:
+            _count(func_name, "coalesced")
+        return future.result()
+
+    try:
+        result = compute()
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            del _in_flight[flight]
+
+
+def canonicalize(value):
+    """Sort dicts and drop secrets so equal requests serialize identically"""
+    if isinstance(value, dict):
+        return {
+            str(k): canonicalize(v)
+            for k, v in sorted(value.items())
+            if k not in SECRET_PARAMS
+        }
+    if isinstance(value, (list, tuple)):
+        return [canonicalize(v) for v in value]
+    return value
+
+
+def make_key(func_name, arguments, casefold_args=()):
+    """
+    Build a stable key from the arguments that identify a cached call.
+    The key is a hash of canonical JSON, so it does not depend on pickle,
+    dict ordering, credentials or the Python version.
+    """
+    parts = {}
+    for name, value in arguments.items():
+        if name in casefold_args and isinstance(value, str):
+            value = value.casefold()
+        parts[name] = canonicalize(value)
+    try:
+        payload = json.dumps([func_name, parts], sort_keys=True, separators=(",", ":"))
+    except TypeError as e:
+        raise TypeError(
+            f"Cannot build a cache key for {func_name}, "
+            "leave non-JSON arguments out of key_args"
+        ) from e
+    return f"{func_name}-{hashlib.md5(payload.encode()).hexdigest()}"
+
+
+def _count(func_name, outcome):
+    with _counters_lock:
+        _counters[func_name][outcome] += 1
+    metrics.inc("cache_requests_total", function=func_name, outcome=outcome)
+
+
+def get_hit_rates():
+    """
+    Returns:
+        dict: Function name to its hits, misses and hit rate in this process.
+        Misses include stale entries, found but past their ttl. Hits include
+        stale_served entries, past their soft_ttl and refreshed in the background,
+        and coalesced calls, which waited for another caller's call instead of
+        making their own.
+    """
+    with _counters_lock:
+        counters = {name: dict(counter) for name, counter in _counters.items()}
+    rates = {}
+    for name, counter in counters.items():
+        memory_hits = counter.get("memory_hit", 0)
+        stale_served = counter.get("stale_served", 0)
+        coalesced = counter.get("coalesced", 0)
+        hits = memory_hits + counter.get("disk_hit", 0) + stale_served + coalesced
+        stale = counter.get("stale", 0)
+        misses = counter.get("miss", 0) + stale
+        rates[name] = {
+            "hits": hits,
+            "memory_hits": memory_hits,
+            "stale_served": stale_served,
+            "coalesced": coalesced,
+            "misses": misses,
+            "stale": stale,
+            "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+        }
+    return rates
+
+
+def compact_cache(backend=None):
+    """
+    Rewrite every entry with the current codec, projecting the results of
+    functions that declare fields, keeping creation and access times.
+    Functions are known by name only once their modules are imported.
+    Entries under legacy keys, bare hashes without the "<function>-" prefix
+    that make_key adds, can never be looked up again and are deleted.
+    Returns:
+        tuple: Entries rewritten, legacy entries deleted, total bytes before
+        and after.
+    """
+    storage = backend or get_backend()
+    rewritten = dropped = bytes_before = bytes_after = 0
+    for key, size, created_at, accessed_at in list(storage.entries()):
+        bytes_before += size
+        # Keys are "<function>-<hash>"
+        func_name = key.rpartition("-")[0]
+        if not func_name:
+            storage.delete(key)
+            dropped += 1
+            continue
+        entry = storage.get(key, touch=False)
+        if entry is None:
+            continue
+        try:
+            value = decode(entry[0])
+        except (
+            EOFError,
+            pickle.UnpicklingError,
+            ValueError,
+            zlib.error,
+            lzma.LZMAError,
+        ):
+            bytes_after += size
+            continue
+        if func_name in _projections:
+            value = project(value, _projections[func_name])
+        data = encode(value)
+        storage.set(
+            key,
+            data,
+            func_name,
+            created_at=created_at,
+            accessed_at=accessed_at,
+        )
+        rewritten += 1
+        bytes_after += len(data)
+    if hasattr(storage, "flush"):
+        storage.flush()
+    return rewritten, dropped, bytes_before, bytes_after
+
+
+def file_cache(
+    cache_dir=None,
+    ttl=None,
+    backend=None,
+    key_args=None,
+    casefold_args=(),
+    negative_ttl=DEFAULT_NEGATIVE_TTL,
+    fields=None,
+    soft_ttl=None,
+):
+    """
+    Cache the return value of a function in memory and on disk.
+    A None result means "not found" and is kept for negative_ttl only. Wrap a
+    result in uncached() when the call failed and must not be cached at all.
+    Args:
+        cache_dir (str): Directory or database holding the entries, see get_backend.
+        ttl (timedelta | float): How long an entry stays valid, forever if None.
+            Past it, callers wait for the function.
+        backend (str): "directory" or "sqlite", defaults to $CACHE_BACKEND or directory.
+        key_args (tuple): Names of the arguments that identify a call. Defaults to
+            every argument except those named in SECRET_PARAMS.
+        casefold_args (tuple): Arguments compared case-insensitively, e.g. usernames.
+        negative_ttl (timedelta | float): How long a None result stays valid.
+        fields (tuple): Keep only these fields of a dict result, as dotted paths
+            such as "edge_followed_by.count". Callers get the projected result
+            on a miss too. Clear the function's entries after adding a field.
+        soft_ttl (timedelta | float): Age after which an entry is still returned,
+            but refreshed in the background. Shorter than ttl, off if None.
+    """
+    if isinstance(ttl, timedelta):
+        ttl = ttl.total_seconds()
+    if isinstance(soft_ttl, timedelta):
+        soft_ttl = soft_ttl.total_seconds()
+    if isinstance(negative_ttl, timedelta):
+        negative_ttl = negative_ttl.total_seconds()
 
-def file_cache(cache_dir="./cache"):
     def decorator(func):
-        def wrapper(*args, **kwargs):
-            # Generate a unique cache key based on function arguments
-            key = hashlib.md5(pickle.dumps((args, kwargs))).hexdigest()
-            cache_path = os.path.join(cache_dir, key)
+        if fields:
+            _projections[func.__name__] = fields
+        signature = inspect.signature(func)
+        names = key_args or [
+            name for name in signature.parameters if name not in SECRET_PARAMS
+        ]
+
+        def key_for(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return make_key(
+                func.__name__,
+                {name: bound.arguments[name] for name in names},
+                casefold_args,
+            )
+
+        def freshness(entry):
+            return _freshness(*entry, ttl, negative_ttl, soft_ttl)
+
+        def lookup_key(storage, key, serve_stale=False, count_miss=True):
+            """
+            Return (True, value, stale) for a fresh entry, or for a stale one when
+            serve_stale is set, and (False, None, False) on a miss. Without
+            count_miss, a miss is left for compute to count.
+            """
+            with metrics.time("cache_lookup_seconds", function=func.__name__):
+                # Check the in-process tier, then the backend
+                entry = memory_cache.get(key)
+                if entry is not None and freshness(entry) == "fresh":
+                    _count(func.__name__, "memory_hit")
+                    return True, entry[0], False
+
+                entry = _read(storage, key) or entry
+                if entry is not None and freshness(entry) == "fresh":
+                    _count(func.__name__, "disk_hit")
+                    memory_cache.set(key, *entry)
+                    return True, entry[0], False
+
+            if serve_stale and entry is not None and freshness(entry) == "stale":
+                _count(func.__name__, "stale_served")
+                _note(_stale_reads, func.__name__)
+                return True, entry[0], True
 
-            # Check if the cache exists and is valid
-            if os.path.exists(cache_path):
-                with open(cache_path, "rb") as f:
-                    return pickle.load(f)
+            if count_miss:
+                _count(func.__name__, "miss" if entry is None else "stale")
+            return False, None, False
 
-            # If not, call the function and cache the result
-            result = func(*args, **kwargs)
-            os.makedirs(cache_dir, exist_ok=True)
-            with open(cache_path, "wb") as f:
-                pickle.dump(result, f)
+        def store_key(storage, key, result):
+            """Store result unless it is uncached() or a disabled negative entry"""
+            if isinstance(result, _Uncached):
+                return result.value
+            if result is None and negative_ttl == 0:
+                return None
+            if fields:
+                result = project(result, fields)
 
+            memory_cache.set(key, result, time.time())
+            storage.set(key, encode(result), func.__name__)
+            _maybe_evict(storage)
             return result
 
+        def compute(storage, key, args, kwargs, count=True):
+            """
+            Call the function under a file lock, so processes sharing the cache
+            wait for each other, and re-check the cache once the lock is held.
+            When count is set, the call is counted as a miss, or as coalesced
+            when another process filled the entry meanwhile.
+            """
+            with file_lock(storage.lock_path(key)):
+                entry = _read(storage, key)
+                if entry is not None and freshness(entry) == "fresh":
+                    metrics.inc("cache_coalesced_total", function=func.__name__)
+                    if count:
+                        _count(func.__name__, "coalesced")
+                    memory_cache.set(key, *entry)
+                    return entry[0]
+                if count:
+                    _count(func.__name__, "miss" if entry is None else "stale")
+
+                value = func(*args, **kwargs)
+                result = store_key(storage, key, value)
+                # Make the entry visible to the next process before unlocking
+                if hasattr(storage, "flush"):
+                    storage.flush()
+                # Hand a failure to every waiting caller, see wrapper
+                return value if isinstance(value, _Uncached) else result
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            storage = get_backend(backend, cache_dir)
+            key = key_for(args, kwargs)
+
+            def refresh(count=True):
+                # Call the function once for every concurrent caller and cache the
+                # result. Background refreshes are not counted, their caller was.
+                return single_flight(
+                    storage,
+                    key,
+                    lambda: compute(storage, key, args, kwargs, count),
+                    func.__name__,
+                    count,
+                )
+
+            found, value, stale = lookup_key(
+                storage, key, _serve_stale, count_miss=False
+            )
+            if stale:
+                revalidate(
+                    storage, key, functools.partial(refresh, False), func.__name__
+                )
+            if found:
+                return value
+            result = refresh()
+            if isinstance(result, _Uncached):
+                _note(_failed_calls, func.__name__)
+                return result.value
+            return result
+
+        def lookup(*args, **kwargs):
+            """
+            Look up a call in the cache without calling the function. Entries past
+            their soft_ttl are not found, so bulk requests refresh them too.
+            """
+            found, value, _ = lookup_key(
+                get_backend(backend, cache_dir), key_for(args, kwargs)
+            )
+            return found, value
+
+        def store(result, *args, **kwargs):
+            """Cache result as the return value of a call, e.g. from a bulk request"""
+            return store_key(
+                get_backend(backend, cache_dir), key_for(args, kwargs), result
+            )
+
+        wrapper.lookup = lookup
+        wrapper.store = store
         return wrapper
 
     return decorator
@@ -0,0 +1,170 @@
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+import threading
+import time
+
+from lib.cache_return_to_file import failed_calls, stale_reads
+from lib.metrics import metrics
+from lib.platforms import PLATFORMS
+
+# Seconds each platform may take before it is reported as not found.
+PLATFORM_TIMEOUTS = {
+    "twitter": 15,
+    "instagram": 15,
+    "linkedin": 30,
+    "youtube": 15,
+    "reddit": 15,
+}
+TOTAL_TIMEOUT = 45
+# The error of a platform skipped because its client's daily quota is used up
+QUOTA_EXHAUSTED = "QuotaExhausted"
+
+
+class FetchError(Exception):
+    """A fetch whose cached calls failed, so its None result is not final"""
+
+
+def get_fetchers(clients):
+    return {
+        platform: getattr(client, PLATFORMS[platform][1])
+        for platform, client in clients.items()
+    }
+
+
+def run_in_thread(fn, *args):
+    """Run fn in a daemon thread so a hung platform never blocks exit"""
+    future = Future()
+
+    def target():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:  # pylint: disable=broad-exception-caught
+            future.set_exception(e)
+
+    threading.Thread(target=target, daemon=True).start()
+    return future
+
+
+def timed_fetcher(platform, fetcher):
+    """
+    Wrap a platform's fetcher to record its latency and errors, and to return
+    whether any cached response it used was stale, as (data, stale). Raises
+    FetchError when a cached call failed and was left uncached, since the
+    fetcher itself just returns None then.
+    """
+
+    def fetch(username):
+        with metrics.time("stage_seconds", platform=platform, stage="fetch"):
+            with stale_reads() as stale, failed_calls() as failed:
+                data = fetcher(username)
+            if failed:
+                raise FetchError(f"{', '.join(sorted(failed))} failed")
+            return data, bool(stale)
+
+    return fetch
+
+
+def iter_platform_data(clients, usernames, platform_timeouts=None, total_timeout=None):
+    """
+    Fetch every platform concurrently, yielding each one as soon as it finishes.
+    Args:
+        clients (dict): Platform name to API client, see build_clients.
+        usernames (dict): Platform name to the username to look up.
+        platform_timeouts (dict): Per-platform deadline in seconds.
+        total_timeout (float): Deadline in seconds for the whole fan-out.
+    Yields:
+        tuple: (platform, normalized data, seconds since the fan-out started,
+        error, stale). The data is None if not found, failed or timed out, and
+        error says why it failed or timed out, else it is None. Platforms whose
+        client's quota_exhausted is set are not fetched, and yield the error
+        QUOTA_EXHAUSTED straight away. stale is True
+        when the data came from a cache entry past its soft TTL, which is being
+        refreshed in the background.
+    """
+    platform_timeouts = {**PLATFORM_TIMEOUTS, **(platform_timeouts or {})}
+    total_timeout = total_timeout or TOTAL_TIMEOUT
+    fetchers = get_fetchers(clients)
+
+    start = time.monotonic()
+    exhausted = [
+        platform
+        for platform in usernames
+        if getattr(clients[platform], "quota_exhausted", False)
+    ]
+    for platform in exhausted:
+        metrics.error(QUOTA_EXHAUSTED, platform=platform, stage="fetch")
+        print(
+            f"Skipped {platform} for {usernames[platform]}: the daily quota is used up"
+        )
+        yield platform, None, time.monotonic() - start, QUOTA_EXHAUSTED, False
+
+    futures = {
+        run_in_thread(timed_fetcher(platform, fetchers[platform]), username): platform
+        for platform, username in usernames.items()
+        if platform not in exhausted
+    }
+    deadlines = {
+        future: start + min(platform_timeouts[platform], total_timeout)
+        for future, platform in futures.items()
+    }
+
+    pending = set(futures)
+    while pending:
+        now = time.monotonic()
+        for future in [f for f in pending if deadlines[f] <= now]:
+            pending.discard(future)
+            platform = futures[future]
+            metrics.error("Timeout", platform=platform, stage="fetch")
+            print(
+                f"Timed out fetching {platform} data for {usernames[platform]} "
+                f"after {now - start:.1f}s"
+            )
+            yield platform, None, now - start, "Timeout", False
+        if not pending:
+            break
+
+        done, pending = wait(
+            pending,
+            timeout=min(deadlines[f] for f in pending) - now,
+            return_when=FIRST_COMPLETED,
+        )
+        for future in done:
+            platform = futures[future]
+            data = error = None
+            stale = False
+            try:
+                data, stale = future.result()
+                print(
+                    f"Fetched {'stale ' if stale else ''}{platform} data "
+                    f"for {usernames[platform]}"
+                )
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"An error occurred while fetching {platform} data: {e}")
+                error = f"{type(e).__name__}: {e}"
+            yield platform, data, time.monotonic() - start, error, stale
+
+
+def fetch_all_data(clients, usernames, platform_timeouts=None, total_timeout=None):
+    """
+    Fetch every platform concurrently, see iter_platform_data.
+    Returns:
+        dict: Platform name to normalized data, None if not found, failed or timed out.
+    """
+    all_data = {platform: None for platform in usernames}
+    for platform, data, *_ in iter_platform_data(
+        clients, usernames, platform_timeouts, total_timeout
+    ):
+        all_data[platform] = data
+    return all_data
+
+
+def get_usernames(username, platforms=None, **overrides):
+    """
+    Map each platform, or each of the given platforms, to
+    `<platform>_username_override` or the shared username
+    """
+    return {
+        platform: overrides.get(f"{platform}_username_override") or username
+        for platform in platforms or PLATFORM_TIMEOUTS
+    }
@@ -0,0 +1,114 @@
+import email.utils
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from lib.metrics import metrics
+from lib.rate_limit import get_limiter
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (500, 502, 503, 504)
+THROTTLE_STATUSES = (429,)
+THROTTLE_RETRIES = 3
+
+
+def build_session(
+    pool_size=DEFAULT_POOL_SIZE,
+    retries=DEFAULT_RETRIES,
+    backoff_factor=DEFAULT_BACKOFF_FACTOR,
+    session=None,
+    platform=None,
+):
+    """
+    Configure a keep-alive session whose connections are reused across calls.
+    Connection errors and 5xx responses are retried with exponential backoff
+    (backoff_factor * 2 ** attempt seconds). Once retries run out the last
+    response is returned, so callers still see it through raise_for_status.
+    Args:
+        pool_size (int): Connections kept open per host, at least the number of threads.
+        retries (int): Retries per request, 0 to disable.
+        backoff_factor (float): Base delay between retries in seconds.
+        session (requests.Session): Existing session to configure, e.g. tweepy's.
+        platform (str): Count the session's responses and bytes under this platform.
+    """
+    session = session or requests.Session()
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if platform:
+        session.hooks["response"].append(record_response(platform))
+    return session
+
+
+def record_response(platform):
+    """Response hook counting status codes and body bytes for the platform"""
+
+    def hook(response, *args, **kwargs):
+        metrics.inc(
+            "http_responses_total", platform=platform, status=str(response.status_code)
+        )
+        metrics.inc(
+            "http_response_bytes_total", len(response.content), platform=platform
+        )
+
+    return hook
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header, in seconds or HTTP date form"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(
+            email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0
+        )
+    except (TypeError, ValueError):
+        return None
+
+
+def send(
+    session,
+    platform,
+    method,
+    url,
+    throttle_statuses=THROTTLE_STATUSES,
+    throttle_retries=THROTTLE_RETRIES,
+    backoff_factor=DEFAULT_BACKOFF_FACTOR,
+    **kwargs,
+):
+    """
+    Send a request through the platform's shared rate limiter. A throttled
+    response holds every request to the platform for its Retry-After, or for
+    exponential backoff without one, and is retried up to throttle_retries times.
+    """
+    limiter = get_limiter(platform)
+    for attempt in range(throttle_retries + 1):
+        with limiter.slot(), metrics.time(
+            "stage_seconds", platform=platform, stage="http"
+        ):
+            response = session.request(method, url, **kwargs)
+        if response.status_code not in throttle_statuses or attempt == throttle_retries:
+            return response
+
+        delay = parse_retry_after(response.headers.get("Retry-After"))
+        if delay is None:
+            delay = backoff_factor * 2 ** (attempt + 1)
+        print(f"{platform} throttled with {response.status_code}, waiting {delay:.1f}s")
+        limiter.backoff(delay)
+    return response
@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+import time
+
+from models.normalized_data import json_default
+
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+class Journal:
+    """
+    Append-only JSONL log of the (username, platform, name) units a batch run
+    has fetched, replayed on restart so that only unfinished units are fetched
+    again. name is the username looked up on the platform, which differs from
+    the request's username when it is overridden. A unit is finished once it
+    succeeded, or failed max_attempts times.
+
+    Every record is written through to the OS straight away, so a crashed
+    process loses nothing. fsync runs every sync_every records or sync_interval
+    seconds, so a power cut costs at most that much work again.
+    """
+
+    def __init__(
+        self,
+        path,
+        max_attempts=DEFAULT_MAX_ATTEMPTS,
+        sync_every=100,
+        sync_interval=1.0,
+    ):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.results = {}
+        self.failures = {}
+        # Finished units whose data came from a stale cache entry
+        self.stale = set()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._replay()
+        self._file = open(path, "a", encoding="utf-8")
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            # Drop a record torn by a crash, so the next one starts on its own line
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                f.truncate(end)
+        for line in data[:end].splitlines():
+            entry = json.loads(line)
+            # Entries from before names were logged looked up the username
+            name = entry.get("name", entry["username"])
+            key = (entry["username"], entry["platform"], name)
+            if "error" in entry:
+                self.failures[key] = self.failures.get(key, 0) + 1
+            else:
+                self.results[key] = entry["data"]
+                if entry.get("stale"):
+                    self.stale.add(key)
+
+    def done(self, username, platform, name):
+        key = (username, platform, name)
+        return key in self.results or self.failures.get(key, 0) >= self.max_attempts
+
+    def result(self, username, platform, name):
+        """The data of a finished unit, None for one that ran out of attempts"""
+        return self.results.get((username, platform, name))
+
+    def record(self, username, platform, name, data=None, error=None, stale=False):
+        """
+        Log a fetched unit, or a failed attempt when error is set. stale marks
+        data served from a stale cache entry.
+        """
+        entry = {"username": username, "platform": platform, "name": name}
+        if error is not None:
+            entry["error"] = error
+        else:
+            entry["data"] = data
+            if stale:
+                entry["stale"] = True
+        line = json.dumps(entry, default=json_default) + "\n"
+
+        key = (username, platform, name)
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if error is not None:
+                self.failures[key] = self.failures.get(key, 0) + 1
+            else:
+                self.results[key] = json.loads(line)["data"]
+                if stale:
+                    self.stale.add(key)
+            self._unsynced += 1
+            if (
+                self._unsynced >= self.sync_every
+                or time.monotonic() - self._synced_at >= self.sync_interval
+            ):
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            self._file.close()
@@ -0,0 +1,199 @@
+import bisect
+import contextlib
+import json
+import math
+import threading
+import time
+
+# Upper bounds in seconds, from a memory cache hit to a slow Chrome page load
+DEFAULT_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+
+HELP = {
+    "stage_seconds": "Time spent per platform and stage: fetch, http, browser, rate_limit_wait",
+    "cache_lookup_seconds": "Time to look up a cached call, hit or miss",
+    "cache_requests_total": "Cached calls by function and outcome: memory_hit, disk_hit, stale_served, stale, miss",
+    "http_responses_total": "HTTP responses by platform and status code",
+    "http_response_bytes_total": "Response body bytes fetched per platform",
+    "errors_total": "Errors by platform, stage and exception type",
+    "cache_coalesced_total": "Cache misses answered by a concurrent call for the same key",
+    "request_seconds": "Time to answer a request to the score service",
+    "coalesced_requests_total": "Score requests that shared a fetch already in flight",
+}
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile, capped at the max seen"""
+        if not self.count:
+            return 0.0
+        rank = math.ceil(q * self.count)
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+def format_labels(labels, **extra):
+    items = [*labels, *extra.items()]
+    if not items:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in items
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Metrics:
+    """Thread-safe counters and latency histograms, keyed by name and labels"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            self._histograms[key].observe(value)
+
+    @contextlib.contextmanager
+    def time(self, name, **labels):
+        """Observe the duration of the block, counting any exception in errors_total"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            self.inc("errors_total", type=type(e).__name__, **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def error(self, error, **labels):
+        """Count an error that was handled, e.g. a timeout that was not raised"""
+        name = error if isinstance(error, str) else type(error).__name__
+        self.inc("errors_total", type=name, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def _snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {
+                key: (list(h.counts), h.count, h.sum, h.max, h.buckets)
+                for key, h in self._histograms.items()
+            }
+        return counters, histograms
+
+    def to_prometheus(self):
+        """Render every metric in the Prometheus text exposition format"""
+        counters, histograms = self._snapshot()
+        lines = []
+        for metric in sorted({name for name, _ in histograms}):
+            if metric in HELP:
+                lines.append(f"# HELP {metric} {HELP[metric]}")
+            lines.append(f"# TYPE {metric} histogram")
+            for (name, labels), (counts, count, total, _, buckets) in sorted(
+                histograms.items()
+            ):
+                if name != metric:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(
+                        f"{name}_bucket{format_labels(labels, le=f'{bound:g}')} {cumulative}"
+                    )
+                lines.append(f"{name}_bucket{format_labels(labels, le='+Inf')} {count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+        for metric in sorted({name for name, _ in counters}):
+            if metric in HELP:
+                lines.append(f"# HELP {metric} {HELP[metric]}")
+            lines.append(f"# TYPE {metric} counter")
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        Returns:
+            dict: Counters and histogram summaries (count, mean, p50/p95/p99, max in
+            seconds), each a list of entries with their labels.
+        """
+        counters, histograms = self._snapshot()
+        result = {"counters": {}, "histograms": {}}
+        for (name, labels), value in sorted(counters.items()):
+            result["counters"].setdefault(name, []).append(
+                {"labels": dict(labels), "value": value}
+            )
+        for (name, labels), (counts, count, total, maximum, buckets) in sorted(
+            histograms.items()
+        ):
+            histogram = Histogram(buckets)
+            histogram.counts, histogram.count, histogram.max = counts, count, maximum
+            result["histograms"].setdefault(name, []).append(
+                {
+                    "labels": dict(labels),
+                    "count": count,
+                    "mean": round(total / count, 4) if count else 0,
+                    "p50": round(histogram.quantile(0.5), 4),
+                    "p95": round(histogram.quantile(0.95), 4),
+                    "p99": round(histogram.quantile(0.99), 4),
+                    "max": round(maximum, 4),
+                }
+            )
+        return result
+
+
+metrics = Metrics()
+
+
+def write_metrics(path):
+    """Write a JSON summary to a .json path, Prometheus text to any other"""
+    with open(path, "w", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            json.dump(metrics.summary(), f, indent=2)
+        else:
+            f.write(metrics.to_prometheus())
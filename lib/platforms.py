@@ -0,0 +1,70 @@
+import importlib
+import os
+
+# Each builder imports its client's module when called, so a run only imports
+# the platforms it fetches. Builders all take (pool_size, browsers), the
+# argument a client doesn't use is prefixed with an underscore.
+
+
+def build_twitter(pool_size, _browsers):
+    from apis.twitter import TwitterAPI
+
+    return TwitterAPI(os.getenv("TWITTER_BEARER_TOKEN"), pool_size=pool_size)
+
+
+def build_instagram(pool_size, _browsers):
+    from apis.instagram import InstagramAPI
+
+    return InstagramAPI(pool_size=pool_size)
+
+
+def build_linkedin(_pool_size, browsers):
+    from scrapers.linkedin import LinkedInScraper
+
+    return LinkedInScraper(pool_size=browsers)
+
+
+def build_youtube(pool_size, _browsers):
+    from apis.youtube import YouTubeAPI
+
+    return YouTubeAPI(os.getenv("YOUTUBE_API_KEY"), pool_size=pool_size)
+
+
+def build_reddit(pool_size, _browsers):
+    from apis.reddit import RedditAPI
+
+    return RedditAPI(
+        client_id=os.getenv("REDDIT_CLIENT_ID"),
+        client_secret=os.getenv("REDDIT_CLIENT_SECRET"),
+        user_agent="cyber233 (by u/SnooDucks8255)",
+        pool_size=pool_size,
+    )
+
+
+# Platform name to the modules of its client and cached fetch functions
+MODULES = {
+    "twitter": "apis.twitter",
+    "instagram": "apis.instagram",
+    "linkedin": "scrapers.linkedin",
+    "youtube": "apis.youtube",
+    "reddit": "apis.reddit",
+}
+
+
+def import_modules():
+    """
+    Import every platform's module, which registers its cached functions, e.g.
+    the fields compact_cache keeps of each.
+    """
+    for module in MODULES.values():
+        importlib.import_module(module)
+
+
+# Platform name to (client builder, name of the client's fetch method)
+PLATFORMS = {
+    "twitter": (build_twitter, "get_normalized_user_data"),
+    "instagram": (build_instagram, "get_normalized_user_data"),
+    "linkedin": (build_linkedin, "get_normalized_user_data"),
+    "youtube": (build_youtube, "get_normalized_channel_data"),
+    "reddit": (build_reddit, "get_normalized_user_data"),
+}
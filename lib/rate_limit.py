@@ -0,0 +1,147 @@
+import contextlib
+import os
+import threading
+import time
+
+from lib.metrics import metrics
+
+# platform: (requests per second, burst, concurrent requests)
+DEFAULT_LIMITS = {
+    "instagram": (0.5, 5, 4),
+    "reddit": (1.5, 10, 8),
+    "twitter": (1, 5, 8),
+    "youtube": (10, 20, 8),
+    "linkedin": (0.5, 3, 4),
+}
+FALLBACK_LIMIT = (1, 5, 4)
+
+
+class PlatformLimiter:
+    """
+    Token bucket plus concurrency cap for one platform. A 429 or Retry-After
+    blocks every request to the platform until the server's deadline.
+    """
+
+    def __init__(self, platform, rate, burst, concurrency):
+        self.platform = platform
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(concurrency)
+        self._tokens = burst
+        self._refilled_at = time.monotonic()
+        self._blocked_until = 0
+        self.waiting = 0
+        self.in_flight = 0
+        self.requests = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _take_token(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed = max(now - self._refilled_at, 0)
+                self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+                self._refilled_at = max(now, self._refilled_at)
+                delay = self._blocked_until - now
+                if delay <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Wait for a token and a free concurrency slot, held for the request"""
+        start = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+        self._semaphore.acquire()
+        try:
+            self._take_token()
+        except BaseException:
+            self._semaphore.release()
+            with self._lock:
+                self.waiting -= 1
+            raise
+
+        waited = time.monotonic() - start
+        with self._lock:
+            self.waiting -= 1
+            self.in_flight += 1
+            self.requests += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        metrics.observe(
+            "stage_seconds", waited, platform=self.platform, stage="rate_limit_wait"
+        )
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._semaphore.release()
+
+    def backoff(self, seconds):
+        """Hold every request to the platform for the next `seconds`"""
+        with self._lock:
+            self.throttled += 1
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            # Resume at the base rate rather than with a burst once the block ends
+            self._tokens = 0
+            self._refilled_at = self._blocked_until
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self.waiting,
+                "in_flight": self.in_flight,
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "avg_wait_seconds": (
+                    round(self.wait_seconds / self.requests, 3) if self.requests else 0
+                ),
+                "max_wait_seconds": round(self.max_wait_seconds, 3),
+                "blocked_for_seconds": round(
+                    max(self._blocked_until - time.monotonic(), 0), 3
+                ),
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limit(platform):
+    """
+    Read RATE_LIMIT_<PLATFORM> as "rate,burst,concurrency", e.g. "1.5,10,8",
+    falling back to DEFAULT_LIMITS.
+    """
+    value = os.getenv(f"RATE_LIMIT_{platform.upper()}")
+    if value:
+        rate, burst, concurrency = value.split(",")
+        return float(rate), float(burst), int(concurrency)
+    return DEFAULT_LIMITS.get(platform, FALLBACK_LIMIT)
+
+
+def get_limiter(platform):
+    """Return the limiter every request to platform in this process shares"""
+    with _limiters_lock:
+        if platform not in _limiters:
+            _limiters[platform] = PlatformLimiter(platform, *get_limit(platform))
+        return _limiters[platform]
+
+
+def scheduler_stats():
+    """
+    Returns:
+        dict: Platform to its queue depth, in-flight requests and wait times.
+    """
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {platform: limiter.stats() for platform, limiter in limiters.items()}
@@ -0,0 +1,126 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from models.normalized_data import json_default
+from privacy_score import SCORE_VERSION, WEIGHTS
+
+DEFAULT_SNAPSHOT_DB = "./snapshots.sqlite3"
+
+
+def to_json_value(value):
+    """Round-trip through JSON so fresh data compares equal to a stored snapshot"""
+    return json.loads(json.dumps(value, default=json_default))
+
+
+def diff_records(old_data, new_data):
+    """
+    Compare two users' per-platform records on the weighted fields only.
+    A platform missing from a record, or not found on it, counts as every field
+    being None.
+    Returns:
+        list: (platform, field, old, new) for every weighted field that changed.
+    """
+    changes = []
+    for platform in sorted(set(old_data) | set(new_data)):
+        old_info = old_data.get(platform) or {}
+        new_info = new_data.get(platform) or {}
+        for field in WEIGHTS.get(platform, {}):
+            old, new = old_info.get(field), new_info.get(field)
+            if old != new:
+                changes.append((platform, field, old, new))
+    return changes
+
+
+class SnapshotStore:
+    """
+    Last known per-platform records and privacy score of every user, in a
+    single SQLite file shared by every thread of the process.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS records (
+            username TEXT NOT NULL,
+            platform TEXT NOT NULL,
+            record TEXT,
+            PRIMARY KEY (username, platform)
+        );
+        CREATE TABLE IF NOT EXISTS scores (
+            username TEXT PRIMARY KEY,
+            privacy_score REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            score_version INTEGER NOT NULL DEFAULT 1
+        );
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.getenv("SNAPSHOT_DB", DEFAULT_SNAPSHOT_DB)
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            self.db_path, timeout=30, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(self.SCHEMA)
+        columns = {
+            row[1] for row in self.connection.execute("PRAGMA table_info(scores)")
+        }
+        # Scores saved before score_version existed were computed under version 1
+        if "score_version" not in columns:
+            self.connection.execute(
+                "ALTER TABLE scores "
+                "ADD COLUMN score_version INTEGER NOT NULL DEFAULT 1"
+            )
+
+    def get(self, username):
+        """
+        Returns:
+            tuple: (all_data, privacy_score, score_version) or None when the user
+            has no snapshot. score_version is the SCORE_VERSION the score was
+            computed under.
+        """
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT privacy_score, score_version FROM scores WHERE username = ?",
+                (username,),
+            ).fetchone()
+            if row is None:
+                return None
+            records = self.connection.execute(
+                "SELECT platform, record FROM records WHERE username = ?",
+                (username,),
+            ).fetchall()
+        all_data = {
+            platform: json.loads(record) if record is not None else None
+            for platform, record in records
+        }
+        return all_data, row[0], row[1]
+
+    def save(self, username, all_data, privacy_score, score_version=SCORE_VERSION):
+        """Replace the user's snapshot in one transaction"""
+        rows = [
+            (username, platform, json.dumps(data) if data is not None else None)
+            for platform, data in all_data.items()
+        ]
+        with self._lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM records WHERE username = ?", (username,)
+            )
+            self.connection.executemany(
+                "INSERT INTO records (username, platform, record) VALUES (?, ?, ?)",
+                rows,
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO scores "
+                "(username, privacy_score, updated_at, score_version) "
+                "VALUES (?, ?, ?, ?)",
+                (username, privacy_score, time.time(), score_version),
+            )
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
@@ -1,16 +1,100 @@
+import json
+import os
+import sys
+from typing import Annotated, List
+
 from dotenv import load_dotenv
 import typer
-from apis.instagram import InstagramAPI
-from apis.reddit import RedditAPI
-from apis.twitter import TwitterAPI
 from pprint import pprint
-import os
 
-from apis.youtube import YouTubeAPI
+from lib.cache_return_to_file import get_hit_rates
+from lib.fetch import (
+    PLATFORM_TIMEOUTS,
+    TOTAL_TIMEOUT,
+    fetch_all_data,
+    get_usernames,
+)
+from lib.http_session import DEFAULT_POOL_SIZE
+from lib.journal import DEFAULT_MAX_ATTEMPTS
+from lib.metrics import write_metrics
+from lib.platforms import PLATFORMS
+from lib.rate_limit import scheduler_stats
 from privacy_score import calculate_overall_privacy_score
-from scrapers.linkedin import LinkedInScraper
+
+app = typer.Typer()
+cache_app = typer.Typer(help="Inspect and maintain the API response cache")
+app.add_typer(cache_app, name="cache")
+
+# Arguments and options shared by the commands that fetch users
+InputPathArgument = Annotated[
+    str,
+    typer.Argument(help="File with one username or JSON request per line, - for stdin"),
+]
+PlatformsOption = Annotated[
+    str,
+    typer.Option(help="Comma-separated platforms to fetch and score, defaults to all"),
+]
+PlatformTimeoutOption = Annotated[
+    List[str],
+    typer.Option(help="Per-platform deadline as platform=seconds, e.g. linkedin=20"),
+]
+TimeoutOption = Annotated[
+    float, typer.Option(help="Deadline in seconds for fetching all platforms")
+]
+BrowsersOption = Annotated[
+    int, typer.Option(help="Headless Chrome instances shared by LinkedIn lookups")
+]
+MetricsOutOption = Annotated[
+    str,
+    typer.Option(
+        help="Write run metrics here, as JSON for a .json path, else Prometheus text"
+    ),
+]
+
+
+def build_clients(pool_size=DEFAULT_POOL_SIZE, browsers=2, platforms=None):
+    """
+    Create one client per platform, or only for the given platforms. Each owns
+    a pooled HTTP session, so share the clients between threads and size
+    pool_size to the number of threads. LinkedIn lookups share at most
+    `browsers` headless Chrome instances.
+    """
+    load_dotenv()
+
+    return {
+        platform: PLATFORMS[platform][0](pool_size, browsers)
+        for platform in platforms or PLATFORM_TIMEOUTS
+    }
+
+
+def parse_platforms(value):
+    """Parse a comma-separated list of platforms, None for all of them"""
+    if not value:
+        return None
+    platforms = [platform.strip() for platform in value.split(",")]
+    unknown = [platform for platform in platforms if platform not in PLATFORMS]
+    if unknown or not platforms:
+        raise typer.BadParameter(
+            f"Expected a comma-separated list of {', '.join(PLATFORMS)}, got {value!r}"
+        )
+    # Fetch in the usual order, whatever order they were given in
+    return [platform for platform in PLATFORM_TIMEOUTS if platform in platforms]
 
 
+def parse_platform_timeouts(values):
+    """Parse `platform=seconds` pairs from the command line"""
+    timeouts = {}
+    for value in values or []:
+        platform, _, seconds = value.partition("=")
+        if platform not in PLATFORM_TIMEOUTS or not seconds:
+            raise typer.BadParameter(
+                f"Expected one of {', '.join(PLATFORM_TIMEOUTS)} as platform=seconds, got {value!r}"
+            )
+        timeouts[platform] = float(seconds)
+    return timeouts
+
+
+@app.command("score")
 def main(
     username: str,
     twitter_username_override: str = None,
@@ -18,79 +102,369 @@ def main(
     youtube_username_override: str = None,
     linkedin_username_override: str = None,
     reddit_username_override: str = None,
+    platforms: PlatformsOption = None,
+    platform_timeout: PlatformTimeoutOption = None,
+    timeout: TimeoutOption = TOTAL_TIMEOUT,
+    stream: Annotated[
+        bool,
+        typer.Option(
+            help="Print a JSON line with a provisional score as each platform finishes"
+        ),
+    ] = False,
+    metrics_out: MetricsOutOption = None,
 ):
-    load_dotenv()
+    """Fetch every platform for one username and print its privacy score"""
+    clients = build_clients(platforms=parse_platforms(platforms))
+
+    usernames = get_usernames(
+        username,
+        platforms=list(clients),
+        twitter_username_override=twitter_username_override,
+        instagram_username_override=instagram_username_override,
+        linkedin_username_override=linkedin_username_override,  # "jeremyclarksonamazon"
+        youtube_username_override=youtube_username_override,
+        reddit_username_override=reddit_username_override,
+    )
+
+    if stream:
+        from batch import open_output, stream_request
+        from models.normalized_data import json_default
 
-    REDDIT_CLIENT_ID = os.getenv("REDDIT_CLIENT_ID")
-    REDDIT_CLIENT_SECRET = os.getenv("REDDIT_CLIENT_SECRET")
-    REDDIT_USER_AGENT = "cyber233 (by u/SnooDucks8255)"
-
-    twitter_api = TwitterAPI(os.getenv("TWITTER_BEARER_TOKEN"))
-    instagram_api = InstagramAPI()
-    youtube_api = YouTubeAPI(os.getenv("YOUTUBE_API_KEY"))
-    reddit_api = RedditAPI(
-        client_id=REDDIT_CLIENT_ID,
-        client_secret=REDDIT_CLIENT_SECRET,
-        user_agent=REDDIT_USER_AGENT,
+        request = {
+            "username": username,
+            **{
+                f"{platform}_username_override": name
+                for platform, name in usernames.items()
+            },
+        }
+        with open_output("-") as out:
+            for event in stream_request(
+                clients,
+                request,
+                platform_timeouts=parse_platform_timeouts(platform_timeout),
+                total_timeout=timeout,
+            ):
+                out.write(json.dumps(event, default=json_default) + "\n")
+                out.flush()
+        if metrics_out:
+            write_metrics(metrics_out)
+        return
+
+    all_data = fetch_all_data(
+        clients,
+        usernames,
+        platform_timeouts=parse_platform_timeouts(platform_timeout),
+        total_timeout=timeout,
     )
-    linkedin_scraper = LinkedInScraper()
-
-    twitter_username = twitter_username_override or username
-    instagram_username = instagram_username_override or username
-    linkedin_username = linkedin_username_override or username  # "jeremyclarksonamazon"
-    youtube_username = youtube_username_override or username
-    reddit_username = reddit_username_override or username
-
-    try:
-        twitter_data = twitter_api.get_normalized_user_data(twitter_username)
-        print(f"Fetched Twitter data for {twitter_username}")
-    except Exception as e:
-        print(f"An error occurred while fetching Twitter data: {e}")
-        twitter_data = None
-
-    try:
-        instagram_data = instagram_api.get_normalized_user_data(instagram_username)
-        print(f"Fetched Instagram data for {instagram_username}")
-    except Exception as e:
-        print(f"An error occurred while fetching Instagram data: {e}")
-        instagram_data = None
-
-    try:
-        linkedin_data = linkedin_scraper.get_normalized_user_data(linkedin_username)
-        print(f"Fetched LinkedIn data for {linkedin_username}")
-    except Exception as e:
-        print(f"An error occurred while fetching LinkedIn data: {e}")
-        linkedin_data = None
-
-    try:
-        youtube_data = youtube_api.get_normalized_channel_data(youtube_username)
-        print(f"Fetched YouTube data for {youtube_username}")
-    except Exception as e:
-        print(f"An error occurred while fetching YouTube data: {e}")
-        youtube_data = None
-
-    try:
-        reddit_data = reddit_api.get_normalized_user_data(reddit_username)
-        print(f"Fetched Reddit data for {reddit_username}")
-    except Exception as e:
-        print(f"An error occurred while fetching Reddit data: {e}")
-        reddit_data = None
 
     print(f"Data for {username}:")
-    all_data = {
-        "twitter": twitter_data,
-        "instagram": instagram_data,
-        "linkedin": linkedin_data,
-        "youtube": youtube_data,
-        "reddit": reddit_data,
-    }
     pprint(all_data)
 
     privacy_score = calculate_overall_privacy_score(all_data)
 
     print(f"\n\n\n\n####### Privacy score #######")
     print(privacy_score)
+    if metrics_out:
+        write_metrics(metrics_out)
+
+
+@app.command()
+def batch(
+    input_path: InputPathArgument = "-",
+    output: Annotated[
+        str, typer.Option("--output", "-o", help="JSONL output file, - for stdout")
+    ] = "-",
+    workers: Annotated[
+        int, typer.Option(help="Number of usernames scored concurrently")
+    ] = 8,
+    browsers: BrowsersOption = 2,
+    platforms: PlatformsOption = None,
+    platform_timeout: PlatformTimeoutOption = None,
+    timeout: TimeoutOption = TOTAL_TIMEOUT,
+    journal: Annotated[
+        str,
+        typer.Option(
+            help="Log fetched platforms here and skip them when the run is restarted"
+        ),
+    ] = None,
+    max_attempts: Annotated[
+        int,
+        typer.Option(help="Runs that may fetch a failed platform, with --journal"),
+    ] = DEFAULT_MAX_ATTEMPTS,
+    metrics_out: MetricsOutOption = None,
+):
+    """
+    Score many usernames, writing one JSON line per user as soon as it finishes.
+    JSON request lines take `username` plus the same `*_username_override` keys as score.
+    With --journal, rerunning the same input after a crash writes the full
+    output again while only fetching the platforms that did not finish.
+    """
+    import functools
+
+    from batch import journaled_request, open_input, open_output, prefetch, run_batch
+    from lib.journal import Journal
+
+    clients = build_clients(
+        pool_size=max(workers, DEFAULT_POOL_SIZE),
+        browsers=browsers,
+        platforms=parse_platforms(platforms),
+    )
+    handlers = {}
+    if journal:
+        log = Journal(journal, max_attempts=max_attempts)
+        if log.results or log.failures:
+            print(
+                f"Resuming with {len(log.results)} platforms fetched "
+                f"and {sum(log.failures.values())} failed attempts",
+                file=sys.stderr,
+            )
+        handlers = {
+            "handler": functools.partial(journaled_request, journal=log),
+            "prefetcher": functools.partial(prefetch, journal=log),
+        }
+    with open_input(input_path) as lines, open_output(output) as out:
+        count, elapsed = run_batch(
+            clients,
+            lines,
+            out,
+            workers=workers,
+            platform_timeouts=parse_platform_timeouts(platform_timeout),
+            total_timeout=timeout,
+            **handlers,
+        )
+    if journal:
+        log.close()
+
+    print(
+        f"Scored {count} users in {elapsed:.1f}s "
+        f"({count / elapsed if elapsed else 0:.2f} users/s)",
+        file=sys.stderr,
+    )
+    if "youtube" in clients:
+        youtube = clients["youtube"]
+        print(
+            f"YouTube quota used today: {youtube.quota_used}/{youtube.daily_quota} units",
+            file=sys.stderr,
+        )
+    for platform, stats in scheduler_stats().items():
+        print(
+            f"{platform}: {stats['requests']} requests, {stats['throttled']} throttled, "
+            f"{stats['avg_wait_seconds']}s average wait for a rate limit slot",
+            file=sys.stderr,
+        )
+    for name, rates in get_hit_rates().items():
+        print(
+            f"Cache {name}: {rates['hits']} hits, {rates['misses']} misses "
+            f"({rates['hit_rate']:.0%} hit rate)",
+            file=sys.stderr,
+        )
+    if metrics_out:
+        write_metrics(metrics_out)
+
+
+@app.command()
+def refresh(
+    input_path: InputPathArgument = "-",
+    output: Annotated[
+        str,
+        typer.Option("--output", "-o", help="JSONL change feed file, - for stdout"),
+    ] = "-",
+    snapshot_db: Annotated[
+        str, typer.Option(help="Snapshot database, defaults to $SNAPSHOT_DB")
+    ] = None,
+    workers: Annotated[
+        int, typer.Option(help="Number of usernames refreshed concurrently")
+    ] = 8,
+    browsers: BrowsersOption = 2,
+    platforms: PlatformsOption = None,
+    platform_timeout: PlatformTimeoutOption = None,
+    timeout: TimeoutOption = TOTAL_TIMEOUT,
+    metrics_out: MetricsOutOption = None,
+):
+    """
+    Re-fetch usernames, rescore only those whose weighted fields changed since
+    their snapshot, and write one JSON line per changed field. With --platforms,
+    the other platforms keep their snapshot records.
+    """
+    import functools
+
+    from batch import open_input, open_output, refresh_request, run_batch
+    from lib.snapshots import SnapshotStore
+
+    clients = build_clients(
+        pool_size=max(workers, DEFAULT_POOL_SIZE),
+        browsers=browsers,
+        platforms=parse_platforms(platforms),
+    )
+    store = SnapshotStore(snapshot_db)
+    with open_input(input_path) as lines, open_output(output) as out:
+        count, elapsed = run_batch(
+            clients,
+            lines,
+            out,
+            workers=workers,
+            platform_timeouts=parse_platform_timeouts(platform_timeout),
+            total_timeout=timeout,
+            handler=functools.partial(refresh_request, store=store),
+        )
+    store.close()
+
+    print(f"Refreshed {count} users in {elapsed:.1f}s", file=sys.stderr)
+    if metrics_out:
+        write_metrics(metrics_out)
+
+
+@app.command("prefetch")
+def prefetch_users(
+    input_path: InputPathArgument = "-",
+    workers: Annotated[
+        int, typer.Option(help="Number of usernames fetched concurrently")
+    ] = 8,
+    browsers: BrowsersOption = 2,
+    platforms: PlatformsOption = None,
+    platform_timeout: PlatformTimeoutOption = None,
+    timeout: TimeoutOption = TOTAL_TIMEOUT,
+):
+    """
+    Re-warm the cache for a list of users ahead of a scheduled audit. Entries
+    past their soft TTL are refreshed and waited for, instead of being served
+    stale, and nothing is written but the cache.
+    """
+    from batch import open_input, run_batch
+    from lib.cache_return_to_file import set_serve_stale
+
+    set_serve_stale(False)
+    clients = build_clients(
+        pool_size=max(workers, DEFAULT_POOL_SIZE),
+        browsers=browsers,
+        platforms=parse_platforms(platforms),
+    )
+    with open_input(input_path) as lines, open(
+        os.devnull, "w", encoding="utf-8"
+    ) as out:
+        count, elapsed = run_batch(
+            clients,
+            lines,
+            out,
+            workers=workers,
+            platform_timeouts=parse_platform_timeouts(platform_timeout),
+            total_timeout=timeout,
+        )
+
+    print(f"Prefetched {count} users in {elapsed:.1f}s")
+    for name, rates in get_hit_rates().items():
+        print(
+            f"Cache {name}: {rates['hits']} hits, {rates['stale']} stale entries "
+            f"refreshed, {rates['misses'] - rates['stale']} misses fetched"
+        )
+
+
+@app.command()
+def serve(
+    host: Annotated[str, typer.Option(help="Interface to listen on")] = "127.0.0.1",
+    port: Annotated[int, typer.Option(help="Port to listen on")] = 8233,
+    pool_size: Annotated[
+        int, typer.Option(help="Pooled connections per platform")
+    ] = DEFAULT_POOL_SIZE,
+    browsers: BrowsersOption = 2,
+    platforms: PlatformsOption = None,
+    platform_timeout: PlatformTimeoutOption = None,
+    timeout: TimeoutOption = TOTAL_TIMEOUT,
+    allow_origin: Annotated[
+        List[str],
+        typer.Option(
+            help="Browser origin allowed to call the service and read its answers, "
+            "e.g. chrome-extension://<id>. Other web pages are refused."
+        ),
+    ] = None,
+):
+    """
+    Serve GET /score/<username>?<platform>=<username> as JSON, keeping clients,
+    connections, caches and browsers warm between requests.
+    """
+    from server import ScoreService, serve as serve_forever
+
+    service = ScoreService(
+        build_clients(
+            pool_size=pool_size,
+            browsers=browsers,
+            platforms=parse_platforms(platforms),
+        ),
+        platform_timeouts=parse_platform_timeouts(platform_timeout),
+        total_timeout=timeout,
+    )
+    serve_forever(service, host, port, allowed_origins=allow_origin or ())
+
+
+@cache_app.command("stats")
+def cache_stats(
+    backend: Annotated[
+        str, typer.Option(help="directory or sqlite, defaults to $CACHE_BACKEND")
+    ] = None,
+):
+    """Print entry count and size of the cache"""
+    from lib.cache_backends import get_backend
+
+    pprint(get_backend(backend).stats())
+
+
+@cache_app.command("cleanup")
+def cache_cleanup(
+    max_age_days: Annotated[
+        float, typer.Option(help="Remove entries created more than this many days ago")
+    ] = 30,
+    backend: Annotated[
+        str, typer.Option(help="directory or sqlite, defaults to $CACHE_BACKEND")
+    ] = None,
+):
+    """Remove old entries, then evict least recently used ones down to the caps"""
+    from lib.cache_backends import get_backend
+    from lib.cache_return_to_file import evict
+
+    store = get_backend(backend)
+    expired = store.cleanup(max_age_days * 24 * 60 * 60)
+    evicted = evict(store)
+    print(f"Removed {expired} expired and {evicted} least recently used entries")
+
+
+@cache_app.command("compact")
+def cache_compact(
+    backend: Annotated[
+        str, typer.Option(help="directory or sqlite, defaults to $CACHE_BACKEND")
+    ] = None,
+):
+    """
+    Rewrite every entry with the current codec ($CACHE_CODEC), keeping only the
+    fields each cached function declares, and delete entries under legacy keys
+    """
+    from lib.cache_backends import get_backend
+    from lib.cache_return_to_file import compact_cache
+    from lib.platforms import import_modules
+
+    # The fields to keep are declared where each fetch function is decorated
+    import_modules()
+    rewritten, dropped, bytes_before, bytes_after = compact_cache(get_backend(backend))
+    print(
+        f"Compacted {rewritten} entries and deleted {dropped} under legacy keys, "
+        f"from {bytes_before / 1024:.1f}KB to {bytes_after / 1024:.1f}KB"
+    )
+
+
+@cache_app.command("migrate")
+def cache_migrate(
+    cache_dir: Annotated[
+        str, typer.Option(help="Directory cache to import, defaults to $CACHE_DIR")
+    ] = None,
+    db_path: Annotated[
+        str, typer.Option(help="SQLite cache to import into, defaults to $CACHE_DB")
+    ] = None,
+):
+    """Import a directory cache into the SQLite backend"""
+    from lib.cache_backends import migrate_directory_to_sqlite
+
+    imported = migrate_directory_to_sqlite(cache_dir, db_path)
+    print(f"Imported {imported} entries, set CACHE_BACKEND=sqlite to use them")
 
 
 if __name__ == "__main__":
-    typer.run(main)
+    app()
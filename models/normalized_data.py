@@ -1,43 +1,245 @@
-from typing import TypedDict
+import dataclasses
+import functools
+import typing
+from array import array
+from dataclasses import dataclass
+from typing import Optional
 
+# array typecodes for the field types stored unboxed in a RecordBatch
+ARRAY_TYPECODES = {int: "q", float: "d", bool: "b"}
 
-class NormalizedData(TypedDict):
-    id: str
-    name: str
-    username: str
-    location: str
-    bio: str
-    profile_picture: None  # Placeholder as profile picture URL is not fetched here
-    email: str
-    followers_count: int
-    following_count: int
-    post_count: int
+
+class NormalizedData:
+    """
+    Base of the per-platform records every normalize_* method returns.
+    Records are slotted and read like the dicts they replace, with get().
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def fields(cls):
+        return field_names(cls)
+
+    def get(self, field, default=None):
+        return getattr(self, field, default) if field in self.fields() else default
+
+    def __getitem__(self, field):
+        if field not in self.fields():
+            raise KeyError(field)
+        return getattr(self, field)
 
     def to_dict(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "username": self.username,
-            "location": self.location,
-            "bio": self.bio,
-            "profile_picture": self.profile_picture,
-            "email": self.email,
-            "followers_count": self.followers_count,
-            "following_count": self.following_count,
-            "post_count": self.post_count,
-        }
+        return {field: getattr(self, field) for field in self.fields()}
 
     @classmethod
     def from_dict(cls, data):
-        return NormalizedData(
-            id=data["id"],
-            name=data["name"],
-            username=data["username"],
-            location=data["location"],
-            bio=data["bio"],
-            profile_picture=data["profile_picture"],
-            email=data["email"],
-            followers_count=data["followers_count"],
-            following_count=data["following_count"],
-            post_count=data["post_count"],
+        """Build a record from a dict, ignoring keys that are not fields"""
+        return cls(**{field: data.get(field) for field in cls.fields()})
+
+
+def slotted(cls):
+    """
+    Rebuild a dataclass with __slots__ for its fields, as dataclass(slots=True)
+    does from Python 3.10. The defaults live on in the generated __init__.
+    """
+    names = tuple(field.name for field in dataclasses.fields(cls))
+    namespace = {
+        key: value
+        for key, value in cls.__dict__.items()
+        if key not in names and key not in ("__dict__", "__weakref__")
+    }
+    namespace["__slots__"] = names
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+
+@functools.cache
+def field_names(record_type):
+    return tuple(field.name for field in dataclasses.fields(record_type))
+
+
+@functools.cache
+def field_types(record_type):
+    """Field name to its type with Optional removed, e.g. int for Optional[int]"""
+    types = {}
+    for name, hint in typing.get_type_hints(record_type).items():
+        args = [arg for arg in typing.get_args(hint) if arg is not type(None)]
+        types[name] = args[0] if len(args) == 1 else hint
+    return types
+
+
+@slotted
+@dataclass
+class InstagramRecord(NormalizedData):
+    name: Optional[str] = None
+    username: Optional[str] = None
+    location: Optional[str] = None
+    bio: Optional[str] = None
+    profile_picture: Optional[str] = None
+    email: Optional[str] = None
+    followers_count: Optional[int] = None
+    following_count: Optional[int] = None
+    post_count: Optional[int] = None
+
+
+@slotted
+@dataclass
+class TwitterRecord(NormalizedData):
+    id: Optional[int] = None
+    name: Optional[str] = None
+    username: Optional[str] = None
+    location: Optional[str] = None
+    bio: Optional[str] = None
+    profile_picture: Optional[str] = None  # Not fetched from the API
+    email: Optional[str] = None  # Not exposed by the API
+    connections: Optional[int] = None
+
+
+@slotted
+@dataclass
+class YouTubeRecord(NormalizedData):
+    id: Optional[str] = None
+    title: Optional[str] = None
+    description: Optional[str] = None
+    statistics: Optional[dict] = None
+    contentDetails: Optional[dict] = None  # pylint: disable=invalid-name
+    location: Optional[str] = None
+    privacyStatus: Optional[str] = None  # pylint: disable=invalid-name
+    isLinked: Optional[bool] = None  # pylint: disable=invalid-name
+
+
+@slotted
+@dataclass
+class RedditRecord(NormalizedData):
+    username: Optional[str] = None
+    user_id: Optional[str] = None
+    account_created: Optional[float] = None
+    is_employee: Optional[bool] = None
+    is_moderator: Optional[bool] = None
+
+
+@slotted
+@dataclass
+class LinkedInRecord(NormalizedData):
+    name: Optional[str] = None
+    bio: Optional[str] = None
+    followers: Optional[int] = None
+    connections: Optional[str] = None
+    address: Optional[str] = None
+    username: Optional[str] = None
+
+
+RECORD_TYPES = {
+    "instagram": InstagramRecord,
+    "twitter": TwitterRecord,
+    "youtube": YouTubeRecord,
+    "reddit": RedditRecord,
+    "linkedin": LinkedInRecord,
+}
+
+
+def json_default(value):
+    """json.dumps default that writes records as dicts"""
+    if isinstance(value, NormalizedData):
+        return value.to_dict()
+    return str(value)
+
+
+class RecordBatch:
+    """
+    Many records of one platform held column by column. int, float and bool
+    fields are stored unboxed in arrays with a null mask, other fields in lists.
+    A row can be None for a user who was not found on the platform.
+    """
+
+    def __init__(self, record_type, records=()):
+        self.record_type = record_type
+        self.found = array("b")
+        self.columns = {}
+        self.nulls = {}
+        for field, field_type in field_types(record_type).items():
+            typecode = ARRAY_TYPECODES.get(field_type)
+            self.columns[field] = array(typecode) if typecode else []
+            if typecode:
+                self.nulls[field] = array("b")
+        self.extend(records)
+
+    def __len__(self):
+        return len(self.found)
+
+    def append(self, record):
+        """Add a record, a dict with the record's fields, or None"""
+        if isinstance(record, dict):
+            record = self.record_type.from_dict(record)
+        self.found.append(record is not None)
+        for field, column in self.columns.items():
+            value = getattr(record, field) if record is not None else None
+            if field in self.nulls:
+                self.nulls[field].append(value is None)
+                column.append(0 if value is None else value)
+            else:
+                column.append(value)
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def value(self, field, row):
+        if field in self.nulls and self.nulls[field][row]:
+            return None
+        value = self.columns[field][row]
+        return bool(value) if field_types(self.record_type)[field] is bool else value
+
+    def __getitem__(self, row):
+        if not self.found[row]:
+            return None
+        return self.record_type(
+            **{field: self.value(field, row) for field in self.columns}
+        )
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+
+    def exposed(self, field):
+        """
+        Per row 1 if the field is set to a truthy value, as get_exposure scores
+        it, else 0. Fields the record type does not have are never exposed.
+        """
+        column = self.columns.get(field)
+        if column is None:
+            return array("b", bytes(len(self)))
+        if field in self.nulls:
+            return array(
+                "b",
+                (
+                    not null and value != 0
+                    for value, null in zip(column, self.nulls[field])
+                ),
+            )
+        return array("b", map(bool, column))
+
+    def to_dicts(self):
+        """One dict per row, None for users not found"""
+        return [record.to_dict() if record else None for record in self]
+
+    @classmethod
+    def from_dicts(cls, record_type, dicts):
+        return cls(record_type, dicts)
+
+
+def batches_from_all_data(all_user_infos):
+    """
+    Split many fetch_all_data results into one RecordBatch per platform, with
+    row i of every batch holding user i.
+    """
+    all_user_infos = list(all_user_infos)
+    platforms = dict.fromkeys(
+        platform for all_user_info in all_user_infos for platform in all_user_info
+    )
+    return {
+        platform: RecordBatch(
+            RECORD_TYPES[platform],
+            (all_user_info.get(platform) for all_user_info in all_user_infos),
         )
+        for platform in platforms
+    }
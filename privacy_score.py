@@ -1,3 +1,7 @@
+from itertools import chain
+from operator import truth
+
+
 def get_exposure(value):
     if not value:  # Not exposed
         return 0
@@ -15,63 +19,299 @@ def calculate_risk(weights, data):
     return total_risk
 
 
-def calculate_overall_privacy_score(all_user_info):
-    weights = {
-        "youtube": {
-            "id": 5,
-            "snippet": 10,
-            "location": 25,
-            "contentDetails": 15,
-            "statistics": 10,
-            "privacyStatus": 10,
-            "isLinked": 5,
-        },
-        "reddit": {
-            "username": 10,
-            "user_id": 5,
-            "account_created": 5,
-            "is_employee": 5,
-            "is_moderator": 10,
-        },
-        "instagram": {
-            "id": 5,
-            "username": 10,
-            "bio": 10,
-            "connections": 15,
-            "profile_picture": 5,
-        },
-        "twitter": {
-            "id": 5,
-            "name": 10,
-            "location": 25,
-            "bio": 10,
-            "connections": 15,
-        },
-        "linkedIn": {
-            "username": 5,
-            "name": 10,
-            "address": 20,
-            "bio": 15,
-            "followers": 15,
-            "connections": 15,
-        },
-    }
+# Bumped whenever WEIGHTS or the formula change, so scores stored by earlier
+# versions can be recomputed before they are compared.
+# 1: LinkedIn unweighted, as its weights were keyed "linkedIn"
+# 2: LinkedIn weighted, counting towards every score's maximum risk
+SCORE_VERSION = 2
+
+WEIGHTS = {
+    "youtube": {
+        "id": 5,
+        "snippet": 10,
+        "location": 25,
+        "contentDetails": 15,
+        "statistics": 10,
+        "privacyStatus": 10,
+        "isLinked": 5,
+    },
+    "reddit": {
+        "username": 10,
+        "user_id": 5,
+        "account_created": 5,
+        "is_employee": 5,
+        "is_moderator": 10,
+    },
+    "instagram": {
+        "id": 5,
+        "username": 10,
+        "bio": 10,
+        "connections": 15,
+        "profile_picture": 5,
+    },
+    "twitter": {
+        "id": 5,
+        "name": 10,
+        "location": 25,
+        "bio": 10,
+        "connections": 15,
+    },
+    "linkedin": {
+        "username": 5,
+        "name": 10,
+        "address": 20,
+        "bio": 15,
+        "followers": 15,
+        "connections": 15,
+    },
+}
+
+# Per-platform field order of the exposure matrices used for bulk scoring
+WEIGHT_FIELDS = {platform: list(weights) for platform, weights in WEIGHTS.items()}
+EMPTY = {}
+
 
+def calculate_overall_privacy_score(all_user_info):
     total_risk = 0
     max_risk = 0
     platforms_found = 0
 
     for platform, user_info in all_user_info.items():
-        platform_weights = weights.get(platform, {})
+        platform_weights = WEIGHTS.get(platform, {})
         if user_info:  # If user is found on this platform
             platforms_found += 1
             total_risk += calculate_risk(platform_weights, user_info)
         max_risk += sum(platform_weights.values()) * 2
 
-    if platforms_found == 0:
-        return 100.0  # Full privacy score if user is not found anywhere
+    # Full privacy score if user is not found anywhere, or only on platforms
+    # that carry no weight
+    if platforms_found == 0 or max_risk == 0:
+        return 100.0
 
     # Adjust score based on platforms found
+    return risk_to_score(total_risk, max_risk)
+
+
+def risk_to_score(total_risk, max_risk):
     normalized_risk = total_risk / max_risk
     privacy_score = 100 - (normalized_risk * 100)
     return round(privacy_score, 2)
+
+
+def provisional_score(all_user_info, pending):
+    """
+    Score a user while some platforms are still being fetched. Each pending
+    platform adds between no risk, when the user is not found on it, and twice
+    its weights, when every weighted field is exposed.
+    Args:
+        all_user_info (dict): The platforms fetched so far, as for
+            calculate_overall_privacy_score.
+        pending (list): Platforms still being fetched.
+    Returns:
+        tuple: (score, lowest, highest). score is over the fetched platforms only,
+        lowest and highest bound the final score.
+    """
+    total_risk = 0
+    known_max_risk = 0
+    platforms_found = 0
+    for platform, user_info in all_user_info.items():
+        platform_weights = WEIGHTS.get(platform, EMPTY)
+        if user_info:
+            platforms_found += 1
+            total_risk += calculate_risk(platform_weights, user_info)
+        known_max_risk += sum(platform_weights.values()) * 2
+    pending_max_risk = sum(
+        sum(WEIGHTS.get(platform, EMPTY).values()) * 2 for platform in pending
+    )
+    max_risk = known_max_risk + pending_max_risk
+
+    score = highest = 100.0
+    if platforms_found and known_max_risk:
+        score = risk_to_score(total_risk, known_max_risk)
+    if platforms_found and max_risk:
+        highest = risk_to_score(total_risk, max_risk)
+    if pending_max_risk:
+        lowest = risk_to_score(total_risk + pending_max_risk, max_risk)
+    else:
+        lowest = highest
+    return score, lowest, highest
+
+
+def build_exposure_matrices(all_user_infos):
+    """
+    Turn many users' per-platform records into exposure matrices. Each value
+    is tested for truthiness, which is what get_exposure does, straight into a
+    byte buffer that numpy reads without copying.
+    Args:
+        all_user_infos (list): One calculate_overall_privacy_score input per user.
+    Returns:
+        tuple: (matrices, present, platforms_found). matrices maps each weighted
+        platform to a users x fields int array of exposures (0 or 2), present
+        maps it to a per-user bool array of whether the platform was looked up
+        at all, and platforms_found counts the platforms each user was found on.
+    """
+    import numpy as np
+
+    count = len(all_user_infos)
+    matrices = {}
+    for platform, fields in WEIGHT_FIELDS.items():
+        exposed = bytes(
+            map(
+                truth,
+                chain.from_iterable(
+                    map((all_user_info.get(platform) or EMPTY).get, fields)
+                    for all_user_info in all_user_infos
+                ),
+            )
+        )
+        matrices[platform] = (
+            np.frombuffer(exposed, dtype=bool).reshape(count, len(fields)) * 2
+        ).astype(np.int64)
+
+    present = {
+        platform: np.fromiter(
+            (platform in all_user_info for all_user_info in all_user_infos),
+            dtype=bool,
+            count=count,
+        )
+        for platform in WEIGHT_FIELDS
+    }
+    platforms_found = np.fromiter(
+        (sum(map(bool, all_user_info.values())) for all_user_info in all_user_infos),
+        dtype=np.int64,
+        count=count,
+    )
+    return matrices, present, platforms_found
+
+
+def compile_weights(weights):
+    """Weight vectors in WEIGHT_FIELDS order, for weights over the same fields"""
+    import numpy as np
+
+    return {
+        platform: np.array(
+            [weights[platform][field] for field in fields], dtype=np.int64
+        )
+        for platform, fields in WEIGHT_FIELDS.items()
+    }
+
+
+def score_exposure_matrices(matrices, present, platforms_found, weights=None):
+    """
+    Score users from their exposure matrices with array operations. The
+    matrices only record which fields are exposed, so after a weight change
+    pass the new weights to rescore them without rebuilding.
+    Returns:
+        list: Privacy scores, equal to calculate_overall_privacy_score per user.
+    """
+    import numpy as np
+
+    weight_vectors = compile_weights(WEIGHTS if weights is None else weights)
+
+    total_risk = np.zeros(len(platforms_found), dtype=np.int64)
+    max_risk = np.zeros(len(platforms_found), dtype=np.int64)
+    for platform, matrix in matrices.items():
+        total_risk += matrix @ weight_vectors[platform]
+        max_risk += present[platform] * (int(weight_vectors[platform].sum()) * 2)
+
+    found = (platforms_found > 0) & (max_risk > 0)
+
+    # Same float64 operations, in the same order, as the scalar function
+    scores = np.full(len(platforms_found), 100.0)
+    normalized_risk = total_risk[found] / max_risk[found]
+    scores[found] = 100 - (normalized_risk * 100)
+
+    # numpy rounds differently from round() in rare cases, so round the few
+    # distinct scores with round() and map them back
+    unique_scores, inverse = np.unique(scores, return_inverse=True)
+    rounded = np.array([round(score, 2) for score in unique_scores.tolist()])
+    return rounded[inverse].tolist()
+
+
+def exposure_matrices_from_batches(batches):
+    """
+    Build the exposure matrices straight from per-platform RecordBatch columns,
+    without materializing records. Every user counts as looked up on every
+    platform in batches, as in a fetch_all_data result.
+    Args:
+        batches (dict): Platform to RecordBatch, row i of each holding user i.
+    Returns:
+        tuple: (matrices, present, platforms_found), see build_exposure_matrices.
+    """
+    import numpy as np
+
+    count = len(next(iter(batches.values()))) if batches else 0
+    matrices = {}
+    for platform, fields in WEIGHT_FIELDS.items():
+        batch = batches.get(platform)
+        if batch is None or not count:
+            matrices[platform] = np.zeros((count, len(fields)), dtype=np.int64)
+            continue
+        exposed = np.column_stack([column_exposure(batch, field) for field in fields])
+        matrices[platform] = exposed.astype(np.int64) * 2
+
+    present = {
+        platform: np.full(count, platform in batches, dtype=bool)
+        for platform in WEIGHT_FIELDS
+    }
+    platforms_found = np.zeros(count, dtype=np.int64)
+    for batch in batches.values():
+        if count:
+            platforms_found += np.frombuffer(batch.found, dtype=np.int8)
+    return matrices, present, platforms_found
+
+
+def column_exposure(batch, field):
+    """RecordBatch.exposed as a bool array, without a Python loop for array columns"""
+    import numpy as np
+
+    column = batch.columns.get(field)
+    if column is None:
+        return np.zeros(len(batch), dtype=bool)
+    if field in batch.nulls:
+        values = np.frombuffer(column, dtype=column.typecode)
+        nulls = np.frombuffer(batch.nulls[field], dtype=np.int8)
+        return (values != 0) & (nulls == 0)
+    return np.frombuffer(bytes(map(truth, column)), dtype=bool)
+
+
+def save_exposure_matrices(path, matrices, present, platforms_found):
+    """
+    Store exposure matrices in a .npz file, so users can be rescored after a
+    weight change without gathering their records again.
+    """
+    import numpy as np
+
+    arrays = {f"matrix_{platform}": matrix for platform, matrix in matrices.items()}
+    arrays.update({f"present_{platform}": mask for platform, mask in present.items()})
+    np.savez_compressed(path, platforms_found=platforms_found, **arrays)
+
+
+def load_exposure_matrices(path):
+    """
+    Returns:
+        tuple: (matrices, present, platforms_found) saved by save_exposure_matrices.
+    """
+    import numpy as np
+
+    with np.load(path) as data:
+        matrices = {platform: data[f"matrix_{platform}"] for platform in WEIGHT_FIELDS}
+        present = {platform: data[f"present_{platform}"] for platform in WEIGHT_FIELDS}
+        return matrices, present, data["platforms_found"]
+
+
+def calculate_privacy_scores(all_user_infos):
+    """
+    Bulk version of calculate_overall_privacy_score for many users. Reading
+    values out of dicts costs about as much as scoring them one by one, so for
+    speed keep records in RecordBatch columns (exposure_matrices_from_batches)
+    or keep their exposure matrices (save_exposure_matrices) and rescore those.
+    Args:
+        all_user_infos (list): Per-user dicts of platform to normalized data.
+    Returns:
+        list: One privacy score per user, in input order.
+    """
+    all_user_infos = list(all_user_infos)
+    if not all_user_infos:
+        return []
+    return score_exposure_matrices(*build_exposure_matrices(all_user_infos))
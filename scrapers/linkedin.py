@@ -1,17 +1,31 @@
+import atexit
+import contextlib
+import queue
 import re
-import time
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
+import threading
+from datetime import timedelta
+import requests
 
-from lib.cache_return_to_file import file_cache
+from lib.cache_return_to_file import file_cache, uncached
+from lib.http_session import DEFAULT_POOL_SIZE, build_session, send
+from lib.metrics import metrics
+from lib.rate_limit import get_limiter
+from models.normalized_data import LinkedInRecord
 
+# selenium and bs4 are imported where they are used, so that commands which
+# never scrape LinkedIn don't pay for importing them at startup.
 
-# Configure headless browser options
-chrome_options = Options()
-chrome_options.add_argument("--headless")
-chrome_options.add_argument("--disable-gpu")
-chrome_options.add_argument("--no-sandbox")
+BLOCK_TAGS = {"p", "div", "li", "section", "h1", "h2", "h3", "h4", "h5", "h6"}
+HEADERS = {
+    # pylint: disable=line-too-long
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+
+class ProfileNotFoundError(Exception):
+    pass
 
 
 def parse_followers(follower_string):
@@ -38,7 +52,20 @@ def parse_followers(follower_string):
         return None
 
 
+def chrome_options():
+    """Headless browser options"""
+    from selenium.webdriver.chrome.options import Options
+
+    options = Options()
+    options.add_argument("--headless")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    return options
+
+
 def fetch_data_from_selector(driver, selector):
+    from selenium.webdriver.common.by import By
+
     try:
         element = driver.find_element(By.CSS_SELECTOR, selector)
         return element.text
@@ -47,25 +74,197 @@ def fetch_data_from_selector(driver, selector):
         return None
 
 
-@file_cache()
-def fetch_linkedin_profile_data(username, sleep_time, selectors):
-    profile_url = f"https://www.linkedin.com/in/{username}"
-    driver = webdriver.Chrome(options=chrome_options)
-    driver.get(profile_url)
-    time.sleep(sleep_time)
+class BrowserPool:
+    """
+    A bounded pool of headless Chrome instances reused across profiles.
+    At most `size` browsers exist at once. A browser is replaced after
+    `max_pages` pages, or straight away when it crashes.
+    """
+
+    def __init__(self, size=2, max_pages=50, page_load_timeout=30):
+        self.size = size
+        self.max_pages = max_pages
+        self.page_load_timeout = page_load_timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        atexit.register(self.close)
+
+    def _start(self):
+        from selenium import webdriver
+
+        driver = webdriver.Chrome(options=chrome_options())
+        driver.set_page_load_timeout(self.page_load_timeout)
+        return driver
+
+    @contextlib.contextmanager
+    def driver(self):
+        from selenium.common.exceptions import WebDriverException
+
+        with self._slots:
+            try:
+                driver, pages = self._idle.get_nowait()
+            except queue.Empty:
+                driver, pages = self._start(), 0
+
+            try:
+                yield driver
+            except WebDriverException:
+                self._quit(driver)
+                raise
+            except BaseException:
+                self._release(driver, pages + 1)
+                raise
+            self._release(driver, pages + 1)
+
+    def _release(self, driver, pages):
+        if pages >= self.max_pages:
+            self._quit(driver)
+        else:
+            self._idle.put((driver, pages))
+
+    def _quit(self, driver):
+        from selenium.common.exceptions import WebDriverException
+
+        try:
+            driver.quit()
+        except WebDriverException as e:
+            print(f"An error occurred while closing Chrome: {e}")
+
+    def close(self):
+        while True:
+            try:
+                driver, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._quit(driver)
+
+
+def wait_for_selectors(driver, selectors, timeout):
+    """Wait until any of the selectors is on the page, at most timeout seconds"""
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.wait import WebDriverWait
+
+    any_selector = ", ".join(selectors.values())
+    try:
+        WebDriverWait(driver, timeout).until(
+            lambda d: d.find_elements(By.CSS_SELECTOR, any_selector)
+        )
+    except TimeoutException:
+        print(f"Timed out waiting for the profile to load: {driver.current_url}")
+
+
+def extract_text(element):
+    """
+    Approximate Selenium's element.text: whitespace in the markup collapses to
+    single spaces, while <br> and block elements start new lines.
+    """
+    from bs4 import Comment, NavigableString
+
+    parts = []
+    for node in element.descendants:
+        if isinstance(node, Comment):
+            continue
+        if isinstance(node, NavigableString):
+            parts.append(re.sub(r"\s+", " ", node))
+        elif node.name == "br" or node.name in BLOCK_TAGS:
+            parts.append("\n")
+    lines = (" ".join(line.split()) for line in "".join(parts).split("\n"))
+    return "\n".join(line for line in lines if line)
+
+
+def parse_profile_html(html, selectors):
+    """
+    Read the selector fields from server-rendered profile HTML.
+    Returns:
+        dict: Field name to its text, None for fields not on the page.
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
     data = {}
+    for key, selector in selectors.items():
+        element = soup.select_one(selector)
+        data[key] = extract_text(element) if element else None
+    return data
+
+
+def fetch_profile_over_http(session, profile_url, selectors):
+    """
+    Fetch the public profile page without a browser.
+    Returns:
+        dict: The selector fields, or None when the page did not include the
+        profile, e.g. because LinkedIn answered with a login wall.
+    Raises:
+        ProfileNotFoundError: LinkedIn answered 404, so no browser is needed.
+    """
     try:
+        response = send(
+            session,
+            "linkedin",
+            "GET",
+            profile_url,
+            # 999 is LinkedIn refusing bots, not a rate limit: rather than hold
+            # the limiter the browser shares, fall back to the browser at once
+            throttle_statuses=(429,),
+            headers=HEADERS,
+            timeout=10,
+        )
+        if response.status_code == 404:
+            raise ProfileNotFoundError(profile_url)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"An error occurred while fetching {profile_url}: {e}")
+        return None
+    data = parse_profile_html(response.text, selectors)
+    return data if data.get("name") else None
+
+
+def fetch_profile_with_browser(pool, profile_url, wait_timeout, selectors):
+    with pool.driver() as driver:
+        # Start every profile from a clean session, as a new browser would
+        driver.delete_all_cookies()
+        with metrics.time("stage_seconds", platform="linkedin", stage="browser"):
+            with get_limiter("linkedin").slot():
+                driver.get(profile_url)
+            wait_for_selectors(driver, selectors, wait_timeout)
+
+        data = {}
         for key, selector in selectors.items():
             data[key] = fetch_data_from_selector(driver, selector)
+        return data
+
+
+@file_cache(
+    ttl=timedelta(days=30),
+    soft_ttl=timedelta(days=7),
+    key_args=("username", "selectors"),
+    casefold_args=("username",),
+)
+def fetch_linkedin_profile_data(scraper, username, selectors):
+    profile_url = f"https://www.linkedin.com/in/{username}"
+    try:
+        data = None
+        if scraper.mode in ("auto", "http"):
+            data = fetch_profile_over_http(scraper.session, profile_url, selectors)
+        if data is None and scraper.mode in ("auto", "browser"):
+            data = fetch_profile_with_browser(
+                scraper.pool, profile_url, scraper.wait_timeout, selectors
+            )
+        if data is None:
+            print(f"Profile not found in the page for {username}")
+            return uncached(None)
 
         data["followers"] = parse_followers(data["followers"])
 
         return data
+    except ProfileNotFoundError:
+        # Cached like any other "not found", for the negative TTL
+        print(f"No LinkedIn profile for {username}")
+        return None
     except Exception as e:
         print(f"An error occurred: {e}")
-        return None
-    finally:
-        driver.quit()
+        return uncached(None)
 
 
 class LinkedInScraper:
@@ -78,15 +277,30 @@ class LinkedInScraper:
         "address": "div.profile-info-subheader > div:nth-child(1)",
     }
 
-    sleep_time = 5
+    # Seconds to wait for the profile to render before reading what is there
+    wait_timeout = 10
 
-    def __init__(self):
-        pass
+    def __init__(self, pool_size=2, max_pages=50, mode="auto"):
+        """
+        Args:
+            pool_size (int): Most headless Chrome instances running at once.
+            max_pages (int): Pages a browser loads before it is replaced.
+            mode (str): "http" parses the server-rendered page only, "browser"
+                always uses Chrome, "auto" tries http and falls back to Chrome.
+        """
+        if mode not in ("auto", "http", "browser"):
+            raise ValueError(f"Unknown LinkedIn scraper mode: {mode}")
+        self.mode = mode
+        self.session = build_session(
+            pool_size=max(pool_size, DEFAULT_POOL_SIZE), platform="linkedin"
+        )
+        self.pool = BrowserPool(size=pool_size, max_pages=max_pages)
 
     def get_normalized_user_data(self, username):
-        data = fetch_linkedin_profile_data(username, self.sleep_time, self.selectors)
-        data["username"] = username
-        return data
+        data = fetch_linkedin_profile_data(self, username, self.selectors)
+        if not data:
+            return None
+        return LinkedInRecord.from_dict({**data, "username": username})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,224 @@
+import json
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from batch import score_request, stream_request
+from lib.metrics import metrics
+from lib.fetch import PLATFORM_TIMEOUTS
+from models.normalized_data import json_default
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8233
+MAX_USERNAME_LENGTH = 100
+ROUTES = ("score", "stream")
+
+
+class ScoreService:
+    """
+    Score usernames with long-lived clients. Concurrent requests for the same
+    username and overrides share a single fetch.
+    """
+
+    def __init__(self, clients, platform_timeouts=None, total_timeout=None):
+        self.clients = clients
+        self.platform_timeouts = platform_timeouts
+        self.total_timeout = total_timeout
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def score(self, request):
+        """
+        Args:
+            request (dict): `username` plus optional `<platform>_username_override` keys.
+        Returns:
+            dict: username, per-platform data, privacy_score and stale, as batch
+            writes them.
+        """
+        key = json.dumps(
+            {**request, "username": request["username"].casefold()}, sort_keys=True
+        )
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            metrics.inc("coalesced_requests_total")
+            return future.result()
+
+        try:
+            result = score_request(
+                self.clients, request, self.platform_timeouts, self.total_timeout
+            )
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def stream(self, request):
+        """
+        Yield stream_request's events for the request. Streams are not coalesced,
+        concurrent fetches of the same profile still share cache entries.
+        """
+        return stream_request(
+            self.clients, request, self.platform_timeouts, self.total_timeout
+        )
+
+
+def parse_score_request(path, query):
+    """
+    Build a score request from /<route>/<username>?<platform>=<username>, where
+    route is one of ROUTES.
+    Returns:
+        dict: The request, or None when the path is not a valid score path.
+    """
+    parts = path.split("/")
+    if len(parts) != 3 or parts[0] or parts[1] not in ROUTES:
+        return None
+    username = unquote(parts[2]).strip()
+    if not username or len(username) > MAX_USERNAME_LENGTH:
+        return None
+
+    request = {"username": username}
+    for name, values in parse_qs(query).items():
+        platform = name.removesuffix("_username_override")
+        if platform not in PLATFORM_TIMEOUTS:
+            raise ValueError(f"Unknown platform override: {name}")
+        request[f"{platform}_username_override"] = values[-1]
+    return request
+
+
+def make_handler(service, allowed_origins=()):
+    """
+    Args:
+        allowed_origins (iterable): Origins whose pages may call the service and
+            read its answers, e.g. the extension's chrome-extension://<id>.
+            Other browser pages are refused, so they can't spend the
+            operator's API keys and quota. Clients that send no Origin, such
+            as curl, need no entry.
+    """
+    allowed_origins = frozenset(allowed_origins)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def send_cors_headers(self):
+            origin = self.headers.get("Origin")
+            if origin in allowed_origins:
+                self.send_header("Access-Control-Allow-Origin", origin)
+                self.send_header("Vary", "Origin")
+
+        def refused(self):
+            """Whether the request comes from a browser page that is not allowed"""
+            origin = self.headers.get("Origin")
+            if origin is not None:
+                return origin not in allowed_origins
+            # Cross-site requests without CORS, e.g. <img src>, carry no Origin
+            return self.headers.get("Sec-Fetch-Site") in ("cross-site", "same-site")
+
+        def reply(self, status, body, content_type="application/json"):
+            data = (
+                body.encode()
+                if isinstance(body, str)
+                else json.dumps(body, default=json_default).encode()
+            )
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.send_cors_headers()
+            self.end_headers()
+            self.wfile.write(data)
+
+        def reply_stream(self, events):
+            """Write each event as a JSON line in its own chunk as it comes"""
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.send_cors_headers()
+            self.end_headers()
+
+            def lines():
+                try:
+                    for event in events:
+                        yield json.dumps(event, default=json_default) + "\n"
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    print(f"An error occurred while streaming: {e}")
+                    yield json.dumps({"event": "error", "error": str(e)}) + "\n"
+
+            try:
+                for line in lines():
+                    self.write_chunk(line)
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # The client went away, pending fetches finish in the background
+                self.close_connection = True
+
+        def write_chunk(self, text):
+            data = text.encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def do_OPTIONS(self):  # pylint: disable=invalid-name
+            if self.refused():
+                return self.reply(403, {"error": "Origin not allowed"})
+            self.send_response(204)
+            self.send_cors_headers()
+            self.send_header("Access-Control-Allow-Methods", "GET, OPTIONS")
+            self.send_header("Access-Control-Allow-Headers", "Content-Type")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            if self.refused():
+                return self.reply(403, {"error": "Origin not allowed"})
+            url = urlsplit(self.path)
+            if url.path == "/health":
+                return self.reply(200, {"status": "ok"})
+            if url.path == "/metrics":
+                return self.reply(
+                    200, metrics.to_prometheus(), "text/plain; version=0.0.4"
+                )
+
+            try:
+                request = parse_score_request(url.path, url.query)
+            except ValueError as e:
+                return self.reply(400, {"error": str(e)})
+            if request is None:
+                return self.reply(404, {"error": f"Not found: {url.path}"})
+
+            if url.path.startswith("/stream/"):
+                with metrics.time("request_seconds", route="stream"):
+                    return self.reply_stream(service.stream(request))
+
+            try:
+                with metrics.time("request_seconds", route="score"):
+                    result = service.score(request)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"An error occurred while scoring {request['username']}: {e}")
+                return self.reply(500, {"error": str(e)})
+            self.reply(200, result)
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            print(f"{self.address_string()} {format % args}")
+
+    return Handler
+
+
+def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT, allowed_origins=()):
+    """Serve the score API until interrupted, see make_handler for allowed_origins"""
+    server = ThreadingHTTPServer((host, port), make_handler(service, allowed_origins))
+    server.daemon_threads = True
+    print(f"Serving privacy scores on http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,140 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from lib.cache_return_to_file import uncached
+from scrapers import linkedin
+from scrapers.linkedin import (
+    LinkedInScraper,
+    fetch_profile_over_http,
+    parse_profile_html,
+)
+
+# The fake sessions answer at once, so LinkedIn's rate limit would only slow the tests
+os.environ["RATE_LIMIT_LINKEDIN"] = "1000,1000,8"
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+PROFILE_URL = "https://www.linkedin.com/in/janedoe"
+SELECTORS = LinkedInScraper.selectors
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+class FakeResponse:
+    def __init__(self, text, status_code=200):
+        self.text = text
+        self.status_code = status_code
+        self.headers = {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error")
+
+
+class FakeSession:
+    """Answers every request with the same page and status"""
+
+    def __init__(self, text, status_code=200):
+        self.text = text
+        self.status_code = status_code
+        self.requests = 0
+
+    def request(self, method, url, **kwargs):
+        self.requests += 1
+        return FakeResponse(self.text, self.status_code)
+
+
+@pytest.fixture(name="public_profile")
+def fixture_public_profile():
+    return read_fixture("linkedin_public_profile.html")
+
+
+@pytest.fixture(name="login_wall")
+def fixture_login_wall():
+    return read_fixture("linkedin_login_wall.html")
+
+
+def test_parse_public_profile(public_profile):
+    assert parse_profile_html(public_profile, SELECTORS) == {
+        "name": "Jane Doe",
+        "bio": "Building data pipelines for privacy-aware analytics.\nPreviously at Acme.",
+        "followers": "12K followers",
+        "connections": "500+ connections",
+        "address": "Amsterdam, North Holland, Netherlands",
+    }
+
+
+def test_parse_login_wall(login_wall):
+    assert parse_profile_html(login_wall, SELECTORS) == dict.fromkeys(SELECTORS)
+
+
+def test_http_fetch_reads_public_profile(public_profile):
+    data = fetch_profile_over_http(FakeSession(public_profile), PROFILE_URL, SELECTORS)
+    assert data["name"] == "Jane Doe"
+
+
+def test_http_fetch_rejects_login_wall(login_wall):
+    assert (
+        fetch_profile_over_http(FakeSession(login_wall), PROFILE_URL, SELECTORS) is None
+    )
+
+
+def fetch_profile(monkeypatch, page, mode="auto", status_code=200):
+    """
+    Run the uncached profile fetch against page, with a browser that records
+    the urls it is asked for.
+    Returns:
+        tuple: The fetched data, the urls loaded in the browser.
+    """
+    browser_urls = []
+
+    def fake_browser(pool, profile_url, wait_timeout, selectors):
+        browser_urls.append(profile_url)
+        return parse_profile_html(
+            read_fixture("linkedin_public_profile.html"), selectors
+        )
+
+    monkeypatch.setattr(linkedin, "fetch_profile_with_browser", fake_browser)
+    scraper = SimpleNamespace(
+        mode=mode, session=FakeSession(page, status_code), pool=None, wait_timeout=0
+    )
+    data = linkedin.fetch_linkedin_profile_data.__wrapped__(
+        scraper, "janedoe", SELECTORS
+    )
+    return data, browser_urls
+
+
+def test_public_profile_skips_browser(monkeypatch, public_profile):
+    data, browser_urls = fetch_profile(monkeypatch, public_profile)
+    assert data["followers"] == 12_000
+    assert not browser_urls
+
+
+def test_login_wall_falls_back_to_browser(monkeypatch, login_wall):
+    data, browser_urls = fetch_profile(monkeypatch, login_wall)
+    assert data["name"] == "Jane Doe"
+    assert browser_urls == [PROFILE_URL]
+
+
+def test_login_wall_in_http_mode_is_not_cached(monkeypatch, login_wall):
+    data, browser_urls = fetch_profile(monkeypatch, login_wall, mode="http")
+    assert isinstance(data, type(uncached(None))) and data.value is None
+    assert not browser_urls
+
+
+@pytest.mark.parametrize("mode", ["auto", "http"])
+def test_missing_profile_is_cached_as_not_found(monkeypatch, mode):
+    data, browser_urls = fetch_profile(monkeypatch, "Not Found", mode, 404)
+    assert data is None
+    assert not browser_urls
+
+
+def test_bot_refusal_falls_back_to_browser_without_retrying(monkeypatch, login_wall):
+    data, browser_urls = fetch_profile(monkeypatch, login_wall, status_code=999)
+    assert data["name"] == "Jane Doe"
+    assert browser_urls == [PROFILE_URL]
+    assert not linkedin.get_limiter("linkedin").stats()["throttled"]